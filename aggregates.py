@@ -0,0 +1,86 @@
+from typing import Dict, Iterable
+
+# Running totals over every parsed match, kept up to date as matches are applied so the navbar
+# and the Elo tables read them instead of walking every match or every Elo history.
+
+class Aggregates:
+    """
+    Hub and per player running totals.
+
+    matches and performance_total / performance_count cover the whole hub. The per player dicts
+    are keyed by player_id, peak_elo and lowest_elo are the highest and lowest Elo after any match,
+    the same values max and min of elo_history give, and totals holds the sum of each stat.
+    """
+
+    def __init__(self):
+        self.matches = 0
+        self.performance_total = 0
+        self.performance_count = 0
+        self.player_performance_total = {}
+        self.player_performance_count = {}
+        self.peak_elo = {}
+        self.lowest_elo = {}
+        self.wins = {}
+        self.losses = {}
+        self.totals = {}
+
+    def add_match(self, match : dict) -> None:
+        "Adds a match from match_json once its Elo data has been calculated"
+        self.matches += 1
+        winners = (match["team_one"], match["team_two"])[match["winner"] - 1]
+        for player, elo_data in match["player_elo_data"].items():
+            performance = elo_data["Performance Actual"]
+            self.performance_total += performance
+            self.performance_count += 1
+            self.player_performance_total[player] = self.player_performance_total.get(player, 0) + performance
+            self.player_performance_count[player] = self.player_performance_count.get(player, 0) + 1
+
+            elo = elo_data["Elo"] + elo_data["Elo Change"]
+            if player not in self.peak_elo or elo > self.peak_elo[player]:
+                self.peak_elo[player] = elo
+            if player not in self.lowest_elo or elo < self.lowest_elo[player]:
+                self.lowest_elo[player] = elo
+
+            if player in winners:
+                self.wins[player] = self.wins.get(player, 0) + 1
+            else:
+                self.losses[player] = self.losses.get(player, 0) + 1
+
+            totals = self.totals.setdefault(player, {})
+            for stat, value in match["player_stats"].get(player, {}).items():
+                totals[stat] = totals.get(stat, 0) + value
+
+    @classmethod
+    def from_matches(cls, matches : Iterable[dict]):
+        "Builds aggregates from parsed matches, used when a dataset is loaded rather than parsed"
+        aggregates = cls()
+        for match in matches:
+            aggregates.add_match(match)
+        return aggregates
+
+    def average_performance(self) -> float:
+        "Average Performance Actual over every player in every match, None if there are no matches"
+        if not self.performance_count:
+            return None
+        return self.performance_total / self.performance_count
+
+    def player_average_performance(self, player_id : str) -> float:
+        count = self.player_performance_count.get(player_id)
+        if not count:
+            return None
+        return self.player_performance_total[player_id] / count
+
+    def player_summary(self, player_id : str) -> Dict[str, float]:
+        "Returns one player's aggregates as a dict"
+        return {
+            "Matches" : self.wins.get(player_id, 0) + self.losses.get(player_id, 0),
+            "Wins" : self.wins.get(player_id, 0),
+            "Losses" : self.losses.get(player_id, 0),
+            "Peak Elo" : self.peak_elo.get(player_id),
+            "Lowest Elo" : self.lowest_elo.get(player_id),
+            "Average Performance" : self.player_average_performance(player_id),
+            **self.totals.get(player_id, {})
+        }
+
+if __name__ == "__main__":
+    pass
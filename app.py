@@ -1,4 +1,6 @@
-from dash import Dash, dcc, html, Input, Output, callback, clientside_callback, ClientsideFunction
+from dash import Dash, dcc, html, Input, Output, callback
+from dataset import load_snapshot_bytes, snapshot_etag
+from flask import Response, abort, request
 
 from layouts import stat_page, match_page, elo_page, match_balance_page, elo_high_score_page, data_retrieve_page
 import callbacks
@@ -6,6 +8,29 @@ import callbacks
 app = Dash(__name__, suppress_callback_exceptions = True)
 server = app.server
 
+@server.route("/download/<dataset_id>/<int:version>")
+def download_snapshot(dataset_id, version):
+    """
+    Serves a dataset version as a snapshot file. Versions never change, so a browser that already
+    has the file gets a 304 without the snapshot being loaded at all.
+    """
+    handle = {"id" : dataset_id, "version" : version}
+    etag = snapshot_etag(handle)
+    if request.if_none_match.contains(etag):
+        response = Response(status = 304)
+    else:
+        try:
+            data = load_snapshot_bytes(handle)
+        except KeyError:
+            abort(404)
+        # Snapshot sections are already zlib compressed, so no Content-Encoding on top
+        response = Response(data, mimetype = "application/octet-stream")
+        response.headers["Content-Disposition"] = 'attachment; filename="dashboard_data.fhsnap"'
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
 colours = {
     "background" : "#272b30",
     "text" : "#FFFFFF"
@@ -14,13 +39,10 @@ colours = {
 content = html.Div(id="page-content", children = [], style = {"background-color" : colours["background"]})
 
 app.layout = html.Div([
-    dcc.Store(id = "player-dict", storage_type='session'),
-    dcc.Store(id = "match-dict", storage_type='session'),
-    dcc.Store(id = "match-list", storage_type='session'),
+    dcc.Store(id = "dataset", storage_type='session'),
     dcc.Store(id = "player-name-lookup", storage_type='session'),
     dcc.Store(id = "submitted-store"),
     dcc.Store(id = "finished-store"),
-    dcc.Store(id = 'elo-data'),
     dcc.Interval(id="interval", interval=1000),
     dcc.Location(id='url'),
     html.Div(id = "navbar"),
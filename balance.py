@@ -0,0 +1,305 @@
+from bisect import bisect_left
+from heapq import heappop, heappush
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+# Team balancing by meet in the middle. The players are split into two halves, every choice of
+# team 1 players from each half is summed once, and the best combinations of a left choice with a
+# right choice are pulled lazily from a heap. For n players this looks at about 2 * 2^(n/2)
+# choices instead of C(n, n/2) teams, so 30 players split 15 a side is still interactive.
+# Constraints are applied before the split, so they make the search smaller rather than filtering it.
+
+Split = Tuple[float, Tuple[int, ...]]
+
+def _items(n : int, team_one : Iterable[int], team_two : Iterable[int], together : Iterable[Iterable[int]],
+           apart : Iterable[Tuple[int, int]]) -> Tuple[List[List[Tuple[int, ...]]], bool]:
+    """
+    Collapses the constraints into items that are placed as a whole. Parties become single units,
+    units that must be split up are joined into one item with a side each, and locked players
+    remove the options that would put them on the wrong team.
+
+    Returns the items, each a list of options giving the players the option puts on team 1, and
+    whether the constraints leave every split equal to its mirror image.
+    """
+
+    units = _units(n, together)
+    unit_of = {player : u for u, members in enumerate(units) for player in members}
+    pins = {}
+    for team, pinned in enumerate((team_one, team_two)):
+        for player in pinned:
+            if pins.setdefault(unit_of[player], team) != team:
+                raise ValueError("A player or party is locked to both teams")
+
+    rivals = [[] for _ in units]
+    for a, b in apart:
+        if unit_of[a] == unit_of[b]:
+            raise ValueError("Players that must be split up are in the same party")
+        rivals[unit_of[a]].append(unit_of[b])
+        rivals[unit_of[b]].append(unit_of[a])
+
+    # Units linked by split up pairs form groups with two sides, one per team
+    colour = {}
+    items = []
+    for root in range(len(units)):
+        if root in colour:
+            continue
+        colour[root] = 0
+        group = [root]
+        for u in group:
+            for rival in rivals[u]:
+                if rival not in colour:
+                    colour[rival] = 1 - colour[u]
+                    group.append(rival)
+                elif colour[rival] == colour[u]:
+                    raise ValueError("Players that must be split up can't all be on different teams")
+        sides = [tuple(sorted(player for u in group if colour[u] == c for player in units[u])) for c in (0, 1)]
+        # Option c puts side c on team 1, a lock on either side rules one option out
+        allowed = {0, 1}
+        for u in group:
+            if u in pins:
+                allowed &= {colour[u] if pins[u] == 0 else 1 - colour[u]}
+        if not allowed:
+            raise ValueError("Locked players contradict the players that must be split up")
+        items.append([sides[c] for c in sorted(allowed)])
+    return items, not pins
+
+def _choices(items : List[List[Tuple[int, ...]]], elos : Sequence[float], max_size : int) -> Dict[int, Tuple[List[float], List[Tuple[int, ...]]]]:
+    "Every way of picking one option per item that puts at most max_size players on team 1, grouped by size and sorted by Elo sum"
+    choices = [(0, 0, ())]
+    for options in items:
+        option_sums = [(len(option), sum([elos[i] for i in option]), option) for option in options]
+        choices = [
+            (size + option_size, total + option_total, members + option)
+            for size, total, members in choices
+            for option_size, option_total, option in option_sums
+            if size + option_size <= max_size
+        ]
+    grouped = {}
+    for size, total, members in choices:
+        grouped.setdefault(size, []).append((total, members))
+    return {size : ([total for total, _ in group], [members for _, members in group]) for size, group in ((size, sorted(group)) for size, group in grouped.items())}
+
+def iter_splits(elos : Sequence[float], team_size : int = None, team_one : Iterable[int] = (), team_two : Iterable[int] = (),
+                together : Iterable[Iterable[int]] = (), apart : Iterable[Tuple[int, int]] = ()) -> Iterator[Split]:
+    """
+    Yields the ways of splitting players into two teams, most even first.
+
+    Parameters
+    ----------
+
+    elos : sequence
+            Elo of each player.
+    team_size : int
+            Size of team 1, team 2 gets everyone else. Defaults to half the players rounded down.
+    team_one : iterable
+            Players that must be on team 1.
+    team_two : iterable
+            Players that must be on team 2.
+    together : iterable
+            Parties, groups of players that must be on the same team.
+    apart : iterable
+            Pairs of players that must be on different teams.
+
+    Yields
+    ------
+
+    split : tuple
+            (elo difference, team 1 player indexes). The elo difference is how far team 1's total
+            Elo is from its share of the total, the same measure even_match has always used. When
+            nobody is locked and the teams are the same size each split appears once rather than
+            once per side.
+
+    Raises
+    ------
+
+    ValueError
+            If the constraints contradict each other.
+    """
+
+    n = len(elos)
+    if team_size is None:
+        team_size = n // 2
+    if not 0 <= team_size <= n:
+        return None
+
+    goal = sum(elos) * team_size / n if n else 0
+    items, unlocked = _items(n, team_one, team_two, together, apart)
+    if unlocked and team_size * 2 == n and items:
+        items[0] = items[0][:1]
+
+    # Constraints shrink the search, a party is one item and a split up pair is one item with two options
+    half = len(items) // 2
+    left = _choices(items[:half], elos, team_size)
+    right = _choices(items[half:], elos, team_size)
+
+    heap = []
+    for left_size, (left_sums, left_members) in left.items():
+        right_size = team_size - left_size
+        if right_size not in right:
+            continue
+        sums, _ = right[right_size]
+        for left_total, members in zip(left_sums, left_members):
+            # The best partners for this left choice sit either side of where goal - left_total would go
+            position = bisect_left(sums, goal - left_total)
+            for step, pos in ((-1, position - 1), (1, position)):
+                if 0 <= pos < len(sums):
+                    heappush(heap, (abs(left_total + sums[pos] - goal), members, right_size, pos, step, left_total))
+
+    while heap:
+        difference, members, right_size, pos, step, left_total = heappop(heap)
+        sums, right_members = right[right_size]
+        yield difference, tuple(sorted(members + right_members[pos]))
+        pos += step
+        if 0 <= pos < len(sums):
+            heappush(heap, (abs(left_total + sums[pos] - goal), members, right_size, pos, step, left_total))
+
+def top_splits(elos : Sequence[float], team_size : int = None, top_k : int = 5, **constraints) -> List[Split]:
+    "Returns the top_k most even splits from iter_splits"
+    return list(islice(iter_splits(elos, team_size, **constraints), max(top_k, 0)))
+
+def _units(n : int, together : Iterable[Iterable[int]]) -> List[Tuple[int, ...]]:
+    "Groups players into units that always go on the same team, parties sharing a player are merged"
+    parent = list(range(n))
+
+    def find(i : int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for party in together:
+        party = list(party)
+        for player in party[1:]:
+            parent[find(player)] = find(party[0])
+    units = {}
+    for i in range(n):
+        units.setdefault(find(i), []).append(i)
+    return [tuple(members) for members in units.values()]
+
+def _swaps(a : Tuple[int, ...], b : Tuple[int, ...], symmetric : bool) -> int:
+    "Number of players that change team between two splits"
+    a, b = set(a), set(b)
+    swaps = len(a - b)
+    if symmetric:
+        swaps = min(swaps, len(a & b))
+    return swaps
+
+def diverse(splits : Iterable[Split], min_swaps : int = 1, symmetric : bool = True) -> Iterator[Split]:
+    """
+    Filters a stream of splits down to ones where at least min_swaps players are on a different team
+    to every earlier split. If symmetric, splits that are the same teams on opposite sides count as equal.
+    """
+    seen = []
+    for split in splits:
+        if all(_swaps(split[1], other, symmetric) >= min_swaps for other in seen):
+            seen.append(split[1])
+            yield split
+
+def pick_lobby(elos : Sequence[float], lobby_size : int, required : Iterable[int] = ()) -> List[int]:
+    """
+    Picks lobby_size players out of a larger pool, choosing the group with the narrowest Elo range and,
+    between groups with the same range, the one that splits most evenly. Players in required are
+    always picked. Returns player indexes.
+    """
+
+    required = sorted(set(required))
+    if len(required) > lobby_size:
+        raise ValueError(f"{len(required)} players have constraints but only {lobby_size} can play")
+    if lobby_size >= len(elos):
+        return list(range(len(elos)))
+    if len(required) == lobby_size:
+        return required
+    # The narrowest range of lobby_size players is always a run of neighbours in Elo order
+    order = sorted(set(range(len(elos))) - set(required), key = lambda i : elos[i])
+    size = lobby_size - len(required)
+    best = None
+    for start in range(len(order) - size + 1):
+        lobby = order[start:start + size] + required
+        lobby_elos = [elos[i] for i in lobby]
+        spread = max(lobby_elos) - min(lobby_elos)
+        if best is not None and spread > best[0]:
+            continue
+        splits = top_splits(lobby_elos, top_k = 1)
+        key = (spread, splits[0][0] if splits else 0)
+        if best is None or key < best[:2]:
+            best = (*key, lobby)
+    return sorted(best[2])
+
+def balance(elo_lookup : Dict[str, float], team_size : int = 5, top_k : int = 5, team_one : Iterable[str] = (), team_two : Iterable[str] = (),
+            together : Iterable[Iterable[str]] = (), apart : Iterable[Tuple[str, str]] = (), min_swaps : int = 1,
+            skip : int = 0) -> Tuple[List[Tuple[float, List[str], List[str]]], List[str]]:
+    """
+    Builds the most even matches out of a pool of players.
+
+    Parameters
+    ----------
+
+    elo_lookup : dict
+            Player : Elo for everyone available to play.
+    team_size : int
+            Players per team. If the pool is bigger than two teams the lobby is picked first with
+            pick_lobby, if it is smaller the pool is split as evenly as possible.
+    top_k : int
+            Number of matches to return.
+    team_one, team_two : iterable
+            Players locked to each team.
+    together : iterable
+            Parties of players that must be on the same team.
+    apart : iterable
+            Pairs of players that must be on different teams.
+    min_swaps : int
+            Minimum number of players that change team between any two matches returned.
+    skip : int
+            Number of matches to skip, for paging through the stream.
+
+    Returns
+    -------
+
+    matches : list
+            (elo difference, team 1, team 2) tuples, most even first.
+    bench : list
+            Players left out of the lobby, never one named in a constraint.
+
+    Raises
+    ------
+
+    ValueError
+            If the constraints contradict each other or name more players than can play.
+    """
+
+    players = list(elo_lookup)
+    elos = [elo_lookup[player] for player in players]
+    together = [list(party) for party in together]
+    apart = [tuple(pair) for pair in apart]
+    team_one, team_two = list(team_one), list(team_two)
+    constrained = [*team_one, *team_two, *[player for party in together for player in party], *[player for pair in apart for player in pair]]
+    index = {player : i for i, player in enumerate(players)}
+
+    lobby = pick_lobby(elos, team_size * 2, [index[player] for player in constrained])
+    in_lobby = set(lobby)
+    bench = [players[i] for i in range(len(players)) if i not in in_lobby]
+    lobby_players = [players[i] for i in lobby]
+    lobby_elos = [elos[i] for i in lobby]
+    lobby_index = {player : i for i, player in enumerate(lobby_players)}
+
+    splits = iter_splits(
+        lobby_elos,
+        team_one = [lobby_index[player] for player in team_one],
+        team_two = [lobby_index[player] for player in team_two],
+        together = [[lobby_index[player] for player in party] for party in together],
+        apart = [(lobby_index[a], lobby_index[b]) for a, b in apart]
+    )
+    symmetric = not (team_one or team_two) and len(lobby) % 2 == 0
+
+    matches = []
+    for difference, team_one_indexes in islice(diverse(splits, min_swaps, symmetric), skip, skip + top_k):
+        members = set(team_one_indexes)
+        matches.append((
+            difference,
+            [lobby_players[i] for i in team_one_indexes],
+            [lobby_players[i] for i in range(len(lobby_players)) if i not in members]
+        ))
+    return matches, bench
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,79 @@
+import os
+import sqlite3
+from typing import Iterable, List
+import ujson
+import zlib
+
+# Stats for a finished match never change, so once a match has been downloaded it is
+# kept on disk and never requested from the API again. Payloads are stored as zlib
+# compressed JSON keyed by match_id.
+
+cache_path = os.environ.get("MATCH_CACHE_PATH", "match_cache.sqlite3")
+
+class MatchCache:
+
+    # SQLite limits the number of bound parameters per statement
+    batch_size = 500
+
+    def __init__(self, path : str = None):
+        self.path = path if path is not None else cache_path
+        self.conn = sqlite3.connect(self.path, timeout = 30)
+        self.conn.execute("PRAGMA journal_mode=WAL") # Web and worker processes can read while a job writes
+        # Each downloaded match is committed on its own, in WAL mode NORMAL only syncs at checkpoints rather than on every
+        # commit. A power cut can lose the last few matches, which are simply downloaded again
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS match_stats (match_id TEXT PRIMARY KEY, data BLOB NOT NULL)")
+        self.conn.commit()
+
+    @staticmethod
+    def encode(data) -> bytes:
+        return zlib.compress(ujson.dumps(data).encode("utf-8"))
+
+    @staticmethod
+    def decode(blob : bytes):
+        return ujson.loads(zlib.decompress(blob))
+
+    def get(self, match_id : str):
+        "Returns the cached stats for a match, or None if it has not been downloaded yet"
+        blob = self.get_raw(match_id)
+        if blob is None:
+            return None
+        return self.decode(blob)
+
+    def get_raw(self, match_id : str) -> bytes:
+        "Returns the compressed payload for a match without decoding it, or None if it has not been downloaded yet"
+        row = self.conn.execute("SELECT data FROM match_stats WHERE match_id = ?", (match_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def missing(self, match_ids : Iterable[str]) -> List[str]:
+        "Returns the match_ids that are not cached, preserving order"
+        match_ids = list(match_ids)
+        cached = set()
+        for i in range(0, len(match_ids), self.batch_size):
+            batch = match_ids[i:i + self.batch_size]
+            placeholders = ", ".join("?" * len(batch))
+            rows = self.conn.execute(f"SELECT match_id FROM match_stats WHERE match_id IN ({placeholders})", batch)
+            cached.update(row[0] for row in rows)
+        return [match_id for match_id in match_ids if match_id not in cached]
+
+    def put(self, match_id : str, data) -> None:
+        "Stores the stats for a single match, matches without stats are skipped"
+        if data is not None:
+            self.put_raw(match_id, self.encode(data))
+
+    def put_raw(self, match_id : str, blob : bytes) -> None:
+        "Stores an already compressed payload"
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO match_stats (match_id, data) VALUES (?, ?)", (match_id, blob))
+
+    def __contains__(self, match_id : str) -> bool:
+        return self.conn.execute("SELECT 1 FROM match_stats WHERE match_id = ?", (match_id,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM match_stats").fetchone()[0]
+
+    def close(self) -> None:
+        self.conn.close()
+
+if __name__ == "__main__":
+    pass
@@ -1,11 +1,19 @@
 import base64
-from dash import Input, Output, State, callback, clientside_callback, dash_table, dcc, html, ClientsideFunction
+from dash import Input, Output, State, callback, dash_table, dcc, html
 import dash_bootstrap_components as dbc
 import dash
+from dataset import DatasetExpired, checkout_players, hub_dataset, load_match, load_match_list, load_player_name_lookup, load_players, refresh_dataset, register_hub, save_dataset, save_matches, set_hub_dataset
 from dotenv import load_dotenv
 from elo import Elo
 from faceit import HubMatches, Match, Player
-import ujson as json
+from fetcher import rate_limit
+from functools import wraps
+from itertools import chain, combinations
+from memo import RedisLRU
+from progress import ProgressReporter
+from rolling import COUNTING_STATS
+from store import PlayerStatsStore
+from typing import Iterator
 import logging
 import os
 import pandas as pd
@@ -13,6 +21,7 @@ import plotly.express as px
 from rq import Queue, get_current_job
 from rq.job import Job
 from rq.exceptions import NoSuchJobError
+from snapshot import is_snapshot, iter_snapshot, load_snapshot
 import uuid
 from worker import conn
 
@@ -24,6 +33,16 @@ load_dotenv()
 api_key = os.environ["API_KEY"]
 offset = 0
 actual_limit = 50_000
+# Seconds, a cold fetch makes about one rate limited request per match, doubled to leave room for retries and parsing
+fetch_timeout = int(os.environ.get("FETCH_TIMEOUT", 2 * actual_limit / rate_limit))
+
+# Team balancing results keyed by who is playing and their Elo, shared by every web worker
+balance_memo = RedisLRU("balance", int(os.environ.get("BALANCE_MEMO_SIZE", 1000)))
+# Rendered tables and figures keyed by dataset version and callback inputs
+callback_memo = RedisLRU("callbacks", int(os.environ.get("CALLBACK_MEMO_SIZE", 500)))
+
+upload_chunk_size = 256 * 1024 # Base64 characters decoded at a time, must be a multiple of 4
+upload_batch_size = 100 # Matches written to Redis at a time, bounds the parsed matches held in memory
 
 data_table_non_editable_kwargs = {
     'style_as_list_view' : True,
@@ -42,30 +61,36 @@ data_table_non_editable_kwargs = {
     'editable' : False
 }
 
-def average_actual_rating(match_dict):
-    actuals = []
-    for match in match_dict:
-        for player in match_dict[match]["player_elo_data"]:
-            actuals.append(match_dict[match]["player_elo_data"][player]["Performance Actual"])
-    return sum(actuals) / len(actuals)
+def skip_expired(func):
+    """
+    Leaves a callback's outputs as they are when its dataset version has expired.
+    retrieve_output notices the expired handle and tells the user to fetch the hub again.
+    """
+
+    @wraps(func)
+    def wrapper(*args):
+        try:
+            return func(*args)
+        except DatasetExpired:
+            raise dash.exceptions.PreventUpdate
+    return wrapper
 
 @callback(
 	Output("navbar", "children"),
-    Input("match-dict", "data"),
-    Input("match-list", "data")
+    Input("dataset", "data")
 )
-def render_navbar(match_dict, match_list):
-
-    if match_dict is not None:
+def render_navbar(dataset):
 
+    if dataset:
         try:
-            avg_rating = round(average_actual_rating(match_dict), 2)
-        except ZeroDivisionError:
-            avg_rating = "Null"
-
+            match_list = load_match_list(dataset)
+            avg_rating = load_players(dataset).aggregates.average_performance()
+            avg_rating = "Null" if avg_rating is None else round(avg_rating, 2)
+            brand = f"CSGO Dashboard - Number of matches: {len(match_list)}, average rating: {avg_rating}"
+        except DatasetExpired:
+            brand = "CSGO Dashboard - Dataset expired, fetch the hub again"
     else:
-        avg_rating = "Null"
-        match_list = []
+        brand = "CSGO Dashboard - Number of matches: 0, average rating: Null"
 
     return [
         dbc.NavbarSimple(
@@ -77,7 +102,7 @@ def render_navbar(match_dict, match_list):
                 dbc.NavItem(dbc.NavLink("Elo Hi-Scores", href="/elo-hi-scores", active='exact')),
                 dbc.NavItem(dbc.NavLink("Get Data", href="/data", active='exact')),
             ],
-            brand=f"CSGO Dashboard - Number of matches: {len(match_list)}, average rating: {avg_rating}",
+            brand=brand,
             brand_href="",
             color="primary",
             dark=True,
@@ -91,32 +116,32 @@ def render_navbar(match_dict, match_list):
 def player_dropdown_options_stat_page(player_name_lookup):
     return [{"label" : x, "value" : player_name_lookup[x]} for x in sorted(player_name_lookup.keys())]
 
-# clientside_callback(
-#     ClientsideFunction(
-#         namespace = "clientside",
-#         function_name = "player_dropdown_options_stat_page"
-#     ),
-#     Output('player-name-dropdown', 'options'),
-#     Input('player-name-lookup', 'data')
-# )
-
-clientside_callback(
-    ClientsideFunction(
-        namespace = "clientside",
-        function_name = "get_elo_data"
-    ),
-    Output('elo-data', 'data'),
-    Input('player-dict', 'data')
-)
+def get_elo_data(dataset):
+    "Current and peak Elo of every player, used by the Elo tables"
+    player_store = load_players(dataset)
+    peak_elo = player_store.aggregates.peak_elo
+    return {
+        "Player" : [player_store.names[player] for player in player_store],
+        "Current Elo" : [player_store.elos[player] for player in player_store],
+        "Max Elo" : [peak_elo.get(player) for player in player_store]
+    }
 
 @callback(
     Output('player-filter', 'options'),
     Input('player-name-lookup', 'data')
 )
 def player_dropdown_options_match_page(player_name_lookup):
-    options = [{"label" : "All", "value" : "All"}]
-    options += [{"label" : x, "value" : player_name_lookup[x]} for x in sorted(player_name_lookup.keys())]
-    return options
+    return [{"label" : x, "value" : player_name_lookup[x]} for x in sorted(player_name_lookup.keys())]
+
+@callback(
+    Output('map-filter', 'options'),
+    Input("dataset", "data")
+)
+@skip_expired
+def map_dropdown_options(dataset):
+    if not dataset:
+        raise dash.exceptions.PreventUpdate
+    return [{"label" : x, "value" : x} for x in sorted(load_players(dataset).match_index.maps)]
 
 @callback(
     Output('elo-filter', 'options'),
@@ -127,11 +152,15 @@ def player_dropdown_options_match_page(player_name_lookup):
 
 @callback(
     Output("full-elo-table", "children"),
-    Input("elo-data", "data")
+    Input("dataset", "data")
 )
-def full_elo_table(data):
+@skip_expired
+@callback_memo.memoize()
+def full_elo_table(dataset):
+    if not dataset:
+        raise dash.exceptions.PreventUpdate
 
-    df = pd.DataFrame(data)
+    df = pd.DataFrame(get_elo_data(dataset))
     df["Rank"] = df["Current Elo"].rank(ascending = False, method = "first")
     df["Current Elo"] = df["Current Elo"].round()
     df = df.sort_values(by = "Rank", ascending = True)
@@ -148,11 +177,15 @@ def full_elo_table(data):
 
 @callback(
     Output("elo-hiscores-table", "children"),
-    Input("elo-data", "data")
+    Input("dataset", "data")
 )
-def elo_hiscores(data):
+@skip_expired
+@callback_memo.memoize()
+def elo_hiscores(dataset):
+    if not dataset:
+        raise dash.exceptions.PreventUpdate
 
-    df = pd.DataFrame(data)[["Player", "Max Elo"]]
+    df = pd.DataFrame(get_elo_data(dataset))[["Player", "Max Elo"]]
     df["Rank"] = df["Max Elo"].rank(ascending = False, method = "first")
     df["Max Elo"] = df["Max Elo"].round()
     df = df.sort_values(by = "Rank", ascending = True)
@@ -167,25 +200,54 @@ def elo_hiscores(data):
         **data_table_non_editable_kwargs
     )
 
-clientside_callback(
-    ClientsideFunction(
-        namespace = "clientside",
-        function_name = "get_player_stat_data"
-    ),
-    Output('stat-data', 'data'),
+@callback(
+    Output("n-recent-matches", "max"),
+    Output("n-recent-matches", "marks"),
     Input('player-name-dropdown', 'value'),
-    Input('stat-name-dropdown', 'value'),
-    Input("n-recent-matches", "value"),
-    Input("player-dict", "data")
+    Input("dataset", "data")
 )
+@skip_expired
+def n_recent_matches_range(player_name_dropdown, dataset):
+    "Lets the slider reach back over the longest career of the chosen players"
+    if not dataset:
+        raise dash.exceptions.PreventUpdate
+
+    rolling = load_players(dataset).rolling
+    players = player_name_dropdown or list(rolling.sums)
+    longest = max([rolling.matches(player) for player in players] + [1])
+    step = max(longest // 10, 1)
+    marks = {i : f"{i}" for i in range(step, longest + 1, step)}
+    marks[1] = "1"
+    marks[longest] = f"{longest}"
+    return longest, marks
+
+def get_player_stat_data(player_name_dropdown, stat_name_dropdown, n, dataset):
+    "Returns the last n values of a stat for the chosen players"
+    player_store = load_players(dataset)
+    data = {"Match Number" : [], "Player" : [], "Elo" : [], stat_name_dropdown : []}
+    for player in player_name_dropdown:
+        stat_list = player_store[player]["stats"][stat_name_dropdown][-n:]
+        n_matches = len(stat_list)
+        data["Player"].extend([player_store[player]["name"]] * n_matches)
+        data["Match Number"].extend(range(n - n_matches, n))
+        data["Elo"].extend([round(player_store[player]["elo"])] * n_matches)
+        data[stat_name_dropdown].extend(stat_list)
+    return data
 
 @callback(
     Output('scatter', 'figure'),
-    Input('stat-data', 'data'),
+    Input('player-name-dropdown', 'value'),
     Input('stat-name-dropdown', 'value'),
+    Input("n-recent-matches", "value"),
+    Input("dataset", "data")
 )
-def player_stat_graph(data, stat_name_dropdown):
-    df = pd.DataFrame(data)
+@skip_expired
+@callback_memo.memoize()
+def player_stat_graph(player_name_dropdown, stat_name_dropdown, n, dataset):
+    if not dataset or not player_name_dropdown:
+        raise dash.exceptions.PreventUpdate
+
+    df = pd.DataFrame(get_player_stat_data(player_name_dropdown, stat_name_dropdown, n, dataset))
     fig = px.line(df,x = "Match Number", y = stat_name_dropdown, color = "Player")
     fig.update_layout(
         template='plotly_dark',
@@ -197,55 +259,99 @@ def player_stat_graph(data, stat_name_dropdown):
 
 @callback(
     Output('stat-table', 'children'),
-    Input('stat-data', 'data'),
+    Input('player-name-dropdown', 'value'),
     Input('stat-name-dropdown', 'value'),
+    Input("n-recent-matches", "value"),
+    Input("dataset", "data")
 )
-def stat_order_grid(data, stat_name_dropdown):
+@skip_expired
+@callback_memo.memoize()
+def stat_order_grid(player_name_dropdown, stat_name_dropdown, n, dataset):
+    "Mean of the stat over each chosen player's last n matches, and per round for counting stats, from the prefix sums"
+    if not dataset or not player_name_dropdown:
+        raise dash.exceptions.PreventUpdate
 
-    df = pd.DataFrame(data)
-    table_data = df.groupby("Player").mean().reset_index()[["Player", stat_name_dropdown]]
-    df = df.sort_values(by = stat_name_dropdown)
+    player_store = load_players(dataset)
     columns = [{"name" : stat_name_dropdown, "id" : stat_name_dropdown}, {"name" : "Player", "id" : "Player"}]
+    table_data = []
+    for player in player_name_dropdown:
+        row = {"Player" : player_store.names[player], stat_name_dropdown : player_store.rolling.mean(player, stat_name_dropdown, n)}
+        if stat_name_dropdown in COUNTING_STATS:
+            row["Per Round"] = player_store.rolling.per_round(player, stat_name_dropdown, n)
+        table_data.append(row)
+    if stat_name_dropdown in COUNTING_STATS:
+        columns.insert(1, {"name" : "Per Round", "id" : "Per Round", "type" : "numeric", "format" : {"specifier" : ".2f"}})
 
     return [
         dash_table.DataTable(
         id = "player-stat-table", 
         columns = columns, 
-        data = table_data.to_dict('records'),
+        data = table_data,
         sort_action = "native",
         sort_mode = "single",
         **data_table_non_editable_kwargs
         )
     ]
 
-clientside_callback(
-    ClientsideFunction(
-        namespace = "clientside",
-        function_name = "get_match_choices"
-    ),
+def _match_filters(player_filter, map_filter, result_filter) -> dict:
+    """
+    Converts the match explorer filters to MatchIndex query arguments, None if nothing is filtered.
+
+    Every player in player_filter must have played, and won or lost if result_filter is Won or Lost.
+    The match must be on one of the maps in map_filter, any map if it is empty.
+    """
+    player_filter = player_filter or []
+    map_filter = map_filter or []
+    if not player_filter and not map_filter:
+        return None
+    return {
+        "players" : player_filter,
+        "maps" : map_filter,
+        "won_by" : player_filter if result_filter == "Won" else (),
+        "lost_by" : player_filter if result_filter == "Lost" else ()
+    }
+
+def filter_matches(dataset, player_filter = (), map_filter = (), result_filter = "Any Result"):
+    "Returns the IDs of the matches passing the match explorer filters, newest first"
+    filters = _match_filters(player_filter, map_filter, result_filter)
+    if filters is None:
+        return load_match_list(dataset)
+    return load_players(dataset).match_index.query(**filters)
+
+@callback(
     Output('match-choices', 'options'),
     Output("match-choices", "value"),
     Input('player-filter', 'value'),
-    Input("match-dict", "data"),
-    Input("match-list", "data")
+    Input('map-filter', 'value'),
+    Input('result-filter', 'value'),
+    Input("dataset", "data")
 )
+@skip_expired
+def get_match_choices(player_filter, map_filter, result_filter, dataset):
+    if not dataset:
+        raise dash.exceptions.PreventUpdate
+
+    ops = [{"label" : x, "value" : x} for x in filter_matches(dataset, player_filter, map_filter, result_filter)]
+    return ops, (ops[0]["value"] if ops else None)
 
-clientside_callback(
-    ClientsideFunction(
-        namespace = "clientside",
-        function_name = "get_chosen_match_data"
-    ),
+@callback(
     Output("chosen-match-data", "data"),
     Input('match-choices', 'value'),
-    Input("match-dict", "data")
+    State("dataset", "data")
 )
+def get_chosen_match_data(chosen_match, dataset):
+    if not dataset or chosen_match is None:
+        raise dash.exceptions.PreventUpdate
+    return [chosen_match, load_match(dataset, chosen_match)]
 
 @callback(
     Output('scoreboard-container', 'children'),
     Input('chosen-match-data', 'data'),
-    Input("player-dict", "data")
+    State("dataset", "data")
 )
-def display_scoreboard(match_data, player_dict):
+@skip_expired
+@callback_memo.memoize(key = lambda match_data, dataset : (match_data and match_data[0], dataset))
+def display_scoreboard(match_data, dataset):
     chosen_match = match_data[0]
     current_match = match_data[1]
     logging.debug(current_match)
@@ -254,7 +360,7 @@ def display_scoreboard(match_data, player_dict):
             html.H3("Error, match not found")
         ]
 
-    mapper = {player_id : player_data["name"] for player_id, player_data in player_dict.items()}
+    mapper = load_players(dataset).names
 
     team_one_data, team_two_data = Match.scoreboard_data(current_match)
     team_one_df = pd.DataFrame(team_one_data).T.reset_index()
@@ -315,11 +421,13 @@ def display_scoreboard(match_data, player_dict):
     Input('player_name_dropdown', 'value'),
     Input('stat_name_dropdown', 'value'),
     Input("n_recent_matches", "value"),
-    Input("player-dict", "data")
+    Input("dataset", "data")
 )
-def linear_regression(player_name_dropdown, stat_name_dropdown, n_recent_matches, player_dict, per_round = False):
+@skip_expired
+def linear_regression(player_name_dropdown, stat_name_dropdown, n_recent_matches, dataset, per_round = False):
 
     per_round = True
+    player_dict = load_players(dataset)
     d = {player : player_dict[player].linear_regression(stat_name_dropdown, n_recent_matches, per_round).round(2) for player in player_name_dropdown}
     if per_round:
         stat_name_dropdown += " Per Round"
@@ -336,18 +444,22 @@ def linear_regression(player_name_dropdown, stat_name_dropdown, n_recent_matches
 
 @callback(
     Output('elo-div', 'children'),
-    Input('stat-data', 'data'),
+    Input('player-name-dropdown', 'value'),
+    Input("dataset", "data")
 )
-def elo_table(data):
-    df = pd.DataFrame(data)
-    table_data = df.groupby("Player").max().reset_index()[["Player", "Elo"]]
-    df = df.sort_values(by = "Elo")
+@skip_expired
+def elo_table(player_name_dropdown, dataset):
+    if not dataset or not player_name_dropdown:
+        raise dash.exceptions.PreventUpdate
+
+    player_store = load_players(dataset)
+    table_data = [{"Player" : player_store.names[player], "Elo" : round(player_store.elos[player])} for player in player_name_dropdown]
     columns = [{"name" : "Elo", "id" : "Elo"}, {"name" : "Player", "id" : "Player"}]
 
     return dash.dash_table.DataTable(
         id = "table-output",
         columns = columns,
-        data = table_data.to_dict('records'),
+        data = table_data,
         sort_action = "native",
         sort_mode = "single",
         **data_table_non_editable_kwargs
@@ -356,34 +468,91 @@ def elo_table(data):
 @callback(
     Output('match-explorer-h3', 'children'),
     Input('player-filter', 'value'),
-    Input("match-dict", "data"),
-    Input("match-list", "data")
+    Input('map-filter', 'value'),
+    Input('result-filter', 'value'),
+    Input("dataset", "data")
 )
-def match_explorer_h3_func(player_filter, match_dict, match_list):
-    if player_filter == "All":
-        return [
-            html.H3(f"Match Explorer: {len(match_list)} matches found")
-        ]
-    ops = []
-    for x in match_list:
-        try:
-            if player_filter in match_dict[x]["players"]:
-                ops.append({"label" : x, "value" : x})
-        except KeyError:
-            pass
+@skip_expired
+def match_explorer_h3_func(player_filter, map_filter, result_filter, dataset):
+    if not dataset:
+        raise dash.exceptions.PreventUpdate
 
+    filters = _match_filters(player_filter, map_filter, result_filter)
+    if filters is None:
+        found = len(load_match_list(dataset))
+    else:
+        found = load_players(dataset).match_index.count(**filters)
     return [
-        html.H3(f"Match Explorer: {len(ops)} matches found")
+        html.H3(f"Match Explorer: {found} matches found")
     ]
 
+@callback(
+    Output('team-one-lock', 'options'),
+    Output('team-two-lock', 'options'),
+    Output('party', 'options'),
+    Output('split-up', 'options'),
+    Input('elo-filter', 'value'),
+    State('player-name-lookup', 'data')
+)
+def match_create_constraint_options(players, player_name_lookup):
+    names = {player_id : name for name, player_id in (player_name_lookup or {}).items()}
+    options = [{"label" : names.get(player, player), "value" : player} for player in players or []]
+    return options, options, options, options
+
 @callback(
     Output('match-create', 'children'),
+    Output('more-teams', 'n_clicks'),
     Input('elo-filter', 'value'),
-    Input("player-dict", "data")
+    Input('team-size', 'value'),
+    Input('team-one-lock', 'value'),
+    Input('team-two-lock', 'value'),
+    Input('party', 'value'),
+    Input('split-up', 'value'),
+    Input('more-teams', 'n_clicks'),
+    Input("dataset", "data")
 )
-def match_create(players, player_dict):
+@skip_expired
+def match_create(players, team_size, team_one, team_two, party, split_up, page, dataset):
+    if not players or not team_size or not dataset:
+        raise dash.exceptions.PreventUpdate
+
+    # Any change other than asking for more teams starts again from the most even teams
+    ctx = dash.callback_context
+    if ctx.triggered[0]["prop_id"] != "more-teams.n_clicks":
+        page = 0
+    page = page or 0
+
+    player_dict = load_players(dataset)
     player_data = [player_dict[player] for player in players]
-    df = Elo.even_match(player_data)
+
+    def names(selected):
+        "Names of the selected players that are also in the pool"
+        return [player_dict[player]["name"] for player in selected or [] if player in players]
+
+    split_up = names(split_up)
+    top_k = 5
+
+    # Elo is rounded so a lobby is only rebalanced when someone's Elo has really moved
+    key = balance_memo.key(
+        frozenset([(player, round(player_dict[player]["elo"])) for player in players]),
+        int(team_size), frozenset(names(team_one)), frozenset(names(team_two)), frozenset(names(party)), frozenset(split_up), page
+    )
+    try:
+        df = balance_memo.get_or_compute(key, lambda : Elo.even_match(
+            player_data,
+            team_size = int(team_size),
+            top_k = top_k,
+            team_one = names(team_one),
+            team_two = names(team_two),
+            together = [names(party)],
+            apart = list(combinations(split_up, 2)),
+            min_swaps = 2,
+            skip = page * top_k
+        ))
+    except ValueError as e:
+        return html.P(str(e)), page
+    if df.empty:
+        return html.P("No more teams fit these constraints"), page
     data = df.to_dict('records')
     columns=[{"name": i, "id": i} for i in df.columns]
 
@@ -391,100 +560,114 @@ def match_create(players, player_dict):
         id = "table-output",
         columns = columns, 
         data = data
-    )    
+    ), page
 
 @callback(
-    Output("download-output", "data"),
-    Input("download-button", "n_clicks"),
-    State("player-dict", "data"),
-    State("match-dict", "data"),
-    State("match-list", "data"),
-    prevent_initial_call=True,
+    Output("download-button", "href"),
+    Output("download-button", "disabled"),
+    Input("dataset", "data")
 )
-def download_func(n_clicks, player_dict, match_dict, match_list):
-
-    ctx = dash.callback_context
-    if ctx.triggered[0]["prop_id"] != "download-button.n_clicks":
-        print("Fetch Cancelled")
-        raise dash.exceptions.PreventUpdate
-
-    data = {
-        "player_dict" : player_dict,
-        "match_dict" : match_dict,
-        "match_list" : match_list
-    }
-    with open("dashboard_data.json", "w") as f:
-        json.dump(data, f, indent = 4)
-    return dcc.send_file(
-        "./dashboard_data.json"
-    )
+def download_link(dataset):
+    "Points the download button at the snapshot of the current dataset version"
+    if not dataset:
+        return None, True
+    return f"/download/{dataset['id']}/{dataset['version']}", False
 
 def fetch_func(hub_id):
+    """
+    Fetches every match in a hub and saves it as a new dataset, only the handle goes back through the queue.
+    If the scheduler already keeps a dataset for the hub, only matches newer than it are fetched.
+    """
 
     logging.debug("Fetching")
 
+    register_hub(hub_id)
+    synced = hub_dataset(hub_id)
+    if synced is not None:
+        msg, dataset = update_func(hub_id, synced)
+        if dataset is not None:
+            set_hub_dataset(hub_id, dataset)
+            return (msg, dataset)
+
     hub = HubMatches(hub_id)
     match_list = hub.full_match_loop(offset, actual_limit)
-    player_name_lookup = {hub.player_json[player]["name"] : player for player in hub.player_json}
+    dataset = save_dataset(hub.player_json, hub.match_json, match_list)
+    set_hub_dataset(hub_id, dataset)
     logging.debug("Fetch Finished")
 
-    return (
-        f"Found {len(match_list)} matches",
-        hub.player_json,
-        hub.match_json,
-        match_list,
-        player_name_lookup
-    )
+    return (f"Found {len(match_list)} matches", dataset)
 
-def update_func(hub_id, player_json, match_json, match_list):
+def update_func(hub_id, dataset):
+    "Adds a hub's new matches to a dataset as a new version, reading and writing the dataset registry directly"
 
     logging.debug("Updating!")
     print(f"{hub_id}")
 
+    try:
+        # Matches are only ever added, so the hub starts without the old ones and only the new matches are written
+        hub = HubMatches(hub_id, checkout_players(dataset), {})
+        old_match_list = load_match_list(dataset)
+    except KeyError as e:
+        return (f"Update failed: {e.args[0]}, fetch the hub again", None)
     print("Data loaded")
 
-    hub = HubMatches(hub_id, player_json, match_json)
-    old_match_list = match_list.copy()
     match_list = hub.partial_match_loop(offset, actual_limit, old_match_list)
-    player_name_lookup = {hub.player_json[player]["name"] : player for player in hub.player_json}
+    new_match_list = match_list[:len(match_list) - len(old_match_list)]
+    if not new_match_list:
+        return ("Found 0 new matches", refresh_dataset(dataset) or dataset)
+    dataset = save_dataset(hub.player_json, hub.match_json, match_list, new_match_ids = new_match_list, parent = dataset)
     print("Update finished")
-    
-    return (
-        f"Found {len(match_list) - len(old_match_list)} new matches",
-        hub.player_json,
-        hub.match_json,
-        match_list,
-        player_name_lookup
-    )
 
+    return (f"Found {len(new_match_list)} new matches", dataset)
+
+
+def _decode_upload(data : str, progress : ProgressReporter) -> Iterator[bytes]:
+    "Decodes a base64 data URL a chunk at a time, reporting progress in decoded bytes"
+    start = data.index(",") + 1
+    progress.update(unit = "bytes")
+    progress.set_length((len(data) - start) * 3 // 4)
+    for position in range(start, len(data), upload_chunk_size):
+        chunk = base64.b64decode(data[position:position + upload_chunk_size])
+        progress.advance(len(chunk))
+        yield chunk
 
 def upload_func(data):
+    """
+    Streams an uploaded dataset into the dataset registry. Snapshots are decoded, validated and
+    written a batch of matches at a time, so the worker never holds a decoded copy of the whole
+    file. Old JSON exports have no record boundaries and are still read in one go.
+    """
     logging.debug("Uploading")
-    
-    job = get_current_job()
-    job.meta["progress"] = "Starting Upload"
-    job.save_meta()
-    content_type, content_string = data.split(',')
-    decoded = base64.b64decode(content_string)
-    data = json.loads(decoded)
-    
-    job.meta["progress"] = "Data decoded"
-    job.save_meta()
-
-    player_json = data["player_dict"]
-    match_dict = data["match_dict"]
-    match_list = data["match_list"]
-    player_name_lookup = {player_json[player]["name"] : player for player in player_json}
-    job.meta["progress"] = f"Assignment completed, {len(match_list)} matches found"
-    logging.debug(f"Upload contains {len(match_list)} matches")
 
-    return (
-        f"Upload contains {len(match_list)} matches",
-        player_json,
-        match_dict,
-        match_list,
-        player_name_lookup
-    )
+    progress = ProgressReporter(get_current_job(), every = 16 * upload_chunk_size)
+    try:
+        chunks = _decode_upload(data, progress)
+        first = next(chunks, b"")
+        chunks = chain([first], chunks)
+        if is_snapshot(first):
+            dataset_id = str(uuid.uuid4())
+            matches = {}
+            for kind, value in iter_snapshot(chunks):
+                if kind == "match":
+                    matches[value[0]] = value[1]
+                    if len(matches) >= upload_batch_size:
+                        save_matches(dataset_id, matches)
+                        matches = {}
+                else:
+                    player_store, match_list = value
+            save_matches(dataset_id, matches)
+            dataset = save_dataset(player_store, {}, match_list, dataset_id, new_match_ids = ())
+        else:
+            player_store, match_json, match_list = load_snapshot(b"".join(chunks))
+            dataset = save_dataset(player_store, match_json, match_list)
+    except (ValueError, KeyError) as e:
+        logging.debug(f"Upload rejected: {e!r}")
+        return (f"Upload failed: {e}", None)
+    finally:
+        progress.flush()
+
+    logging.debug(f"Upload contains {len(match_list)} matches")
+    return (f"Upload contains {len(match_list)} matches", dataset)
 
 @callback(
     Output("submitted-store", "data"),
@@ -492,13 +675,11 @@ def upload_func(data):
     Input("update-button", "n_clicks"),
     Input("data-upload-button", "n_clicks"),
     Input("hub-id", "value"),
-    Input("player-dict", "data"),
-    Input("match-dict", "data"),
-    Input("match-list", "data"),
     Input("data-upload", "contents"),
+    State("dataset", "data"),
     prevent_initial_call=True,
 )
-def submit(fetch_clicks, update_clicks, upload_clicks, hub_id, player_json, match_json, match_list, uploaded_data):
+def submit(fetch_clicks, update_clicks, upload_clicks, hub_id, uploaded_data, dataset):
     """
     Submit a job to the queue, log the id in submitted-store
     """
@@ -514,15 +695,17 @@ def submit(fetch_clicks, update_clicks, upload_clicks, hub_id, player_json, matc
         if ctx.triggered[0]["prop_id"] != "fetch-button.n_clicks":
             logging.debug("Fetch Cancelled")
             raise dash.exceptions.PreventUpdate
-        q.enqueue(fetch_func, hub_id, job_id = id_, job_timeout = 600)
+        q.enqueue(fetch_func, hub_id, job_id = id_, job_timeout = fetch_timeout)
         # log process id in dcc.Store
         return {"id": id_}
     elif ctx.triggered[0]["prop_id"] == "update-button.n_clicks":
         if ctx.triggered[0]["prop_id"] != "update-button.n_clicks":
             raise dash.exceptions.PreventUpdate
-        q.enqueue(update_func, hub_id, player_json, match_json, match_list, job_id = id_)
+        if not dataset:
+            raise dash.exceptions.PreventUpdate
+        q.enqueue(update_func, hub_id, dataset, job_id = id_, job_timeout = fetch_timeout)
         # log process id in dcc.Store
-        return {"id": id_}
+        return {"id": id_, "dataset": dataset["id"]}
     elif ctx.triggered[0]["prop_id"] == "data-upload.contents":
         print("Master upload")
         q.enqueue(upload_func, uploaded_data, job_id = id_)
@@ -534,19 +717,35 @@ def submit(fetch_clicks, update_clicks, upload_clicks, hub_id, player_json, matc
 
 @callback(
     Output("data-retrieve-msg", "children"),
-    Output("player-dict", "data"),
-    Output("match-dict", "data"),
-    Output("match-list", "data"),
+    Output("dataset", "data"),
     Output("player-name-lookup", "data"),
     Output("finished-store", "data"),
     Input("interval", "n_intervals"),
+    Input("dataset", "data"),
     State("submitted-store", "data"),
+    State("finished-store", "data"),
 )
-def retrieve_output(n, submitted):
+def retrieve_output(n, dataset, submitted, finished):
     """
     Periodically check the most recently submitted job to see if it has
-    completed.
+    completed. Finished results are saved to the dataset registry and only
+    the handle is sent to the browser.
+
+    The session keeps its dataset handle after the version expires in Redis. Whenever the page
+    loads or the handle changes the dataset's TTL is restarted, a handle to a version that has
+    since been updated moves to the latest version, and an expired handle is cleared.
     """
+    if dash.callback_context.triggered[0]["prop_id"] != "interval.n_intervals" and dataset:
+        latest = refresh_dataset(dataset)
+        if latest is None:
+            return "Dataset expired, fetch the hub again", None, {}, dash.no_update
+        if latest != dataset:
+            return "Moved to the latest version of the dataset", latest, load_player_name_lookup(latest), dash.no_update
+    if dash.callback_context.triggered[0]["prop_id"] == "dataset.data":
+        raise dash.exceptions.PreventUpdate
+    if finished and submitted and finished.get("id") == submitted["id"]:
+        # Result already saved, the interval fired again before being disabled
+        raise dash.exceptions.PreventUpdate
     if n and submitted:
         try:
             job = Job.fetch(submitted["id"], connection=conn)
@@ -555,17 +754,23 @@ def retrieve_output(n, submitted):
                 # job is finished, return result, and store id
                 logging.debug("Attempting to retrieve job results")
                 msg = job.result[0]
-                player_json = job.result[1]
-                match_json = job.result[2]
-                match_list = job.result[3]
-                player_name_lookup = job.result[4]
+                if len(job.result) == 2:
+                    # The job saved the dataset itself and returned its handle
+                    dataset = job.result[1]
+                    if dataset is None:
+                        return msg, dash.no_update, dash.no_update, {"id": submitted["id"]}
+                    player_name_lookup = load_player_name_lookup(dataset)
+                else:
+                    # Jobs queued before every job saved its own dataset return the whole hub
+                    player_json = job.result[1]
+                    match_json = job.result[2]
+                    match_list = job.result[3]
+                    player_name_lookup = job.result[4]
+                    dataset = save_dataset(PlayerStatsStore.from_json(player_json, match_json), match_json, match_list, submitted.get("dataset"))
 
                 return (
                     msg,
-                    player_json,
-                    #json.dumps(player_json, check_circular=False),
-                    match_json,
-                    match_list,
+                    dataset,
                     player_name_lookup,
                     {"id": submitted["id"]},
                 )
@@ -573,10 +778,12 @@ def retrieve_output(n, submitted):
             # job is still running, get progress and update progress bar
             progress = job.meta.get("progress", 0)
             length = job.meta.get("length", 0)
+            unit = job.meta.get("unit", "matches")
+            rate = ""
+            if "rate" in job.meta:
+                rate = f", {job.meta['rate']} {unit}/s, about {round(job.meta.get('eta', 0))}s remaining"
             return (
-                f"In progress: {progress} matches out of {length}, job status {job.get_status()}, last_hearbeat {job.last_heartbeat}",
-                dash.no_update,
-                dash.no_update,
+                f"In progress: {progress} {unit} out of {length}{rate}, job status {job.get_status()}, last_hearbeat {job.last_heartbeat}",
                 dash.no_update,
                 dash.no_update,
                 dash.no_update,
@@ -588,16 +795,12 @@ def retrieve_output(n, submitted):
                 dash.no_update,
                 dash.no_update,
                 dash.no_update,
-                dash.no_update,
-                dash.no_update,
             )
     # nothing submitted yet, return nothing.
     return (
         "Nothing submitted",
         dash.no_update,
         dash.no_update,
-        dash.no_update,
-        dash.no_update,
         {},
     )
 
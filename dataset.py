@@ -0,0 +1,304 @@
+from delta import apply_patch, make_patch
+from functools import lru_cache
+import os
+import pickle
+import time
+from snapshot import FORMAT_VERSION, dump_snapshot
+from store import PlayerStatsStore
+from typing import Dict, Iterable, List, Tuple, Union
+import ujson
+import uuid
+from worker import conn
+import zlib
+
+# Server side registry of hub datasets. The browser only holds a handle of the form
+# {"id" : str, "version" : int} and callbacks load the parts they need from Redis.
+#
+# dataset:{id}:matches      hash of match_id : match json, matches never change once parsed
+#                           so every version of a dataset shares it
+# dataset:{id}:{version}    hash holding either a full version, the player store, match_list and
+#                           player_name_lookup, or a delta version, the full base version it builds
+#                           on, the match IDs added since and a delta.py patch of the players they
+#                           touched. Either may hold the version's download snapshot once it has
+#                           been built. Versions are kept for superseded_ttl once a newer one is saved
+# dataset:{id}:version      the latest version of the dataset
+# hub:{hub_id}:dataset      ID of the dataset sync jobs keep up to date for a hub
+# hub_activity              sorted set of the hub IDs the scheduler syncs, scored by when each was
+#                           last fetched from the dashboard
+# merged:{id}               JSON player view merged across several hubs' datasets
+
+dataset_ttl = int(os.environ.get("DATASET_TTL", 7 * 24 * 60 * 60)) # Seconds
+superseded_ttl = int(os.environ.get("DATASET_SUPERSEDED_TTL", 60 * 60)) # Seconds a version is kept once a newer one is saved
+delta_fraction = float(os.environ.get("DATASET_DELTA_FRACTION", 0.1)) # Largest share of the base's matches a delta may add
+hub_idle_ttl = int(os.environ.get("HUB_IDLE_TTL", dataset_ttl)) # Seconds a hub is synced for after it was last fetched from the dashboard
+cached_versions = int(os.environ.get("DATASET_CACHED_VERSIONS", 4)) # Versions kept in memory by each web process
+
+class DatasetExpired(KeyError):
+    "Raised when a dataset version has expired or never existed"
+
+def _matches_key(dataset_id : str) -> str:
+    return f"dataset:{dataset_id}:matches"
+
+def _version_key(dataset_id : str, version : int) -> str:
+    return f"dataset:{dataset_id}:{version}"
+
+def _latest_key(dataset_id : str) -> str:
+    return f"dataset:{dataset_id}:version"
+
+def _delta_base(parent : dict, match_list : List[str]) -> Tuple[int, List[str]]:
+    "Returns the base version a version updated from parent can be a delta of and the match IDs added since, None to save it in full"
+    base = conn.hget(_version_key(parent["id"], parent["version"]), "base")
+    base_version = parent["version"] if base is None else int(base)
+    try:
+        base_match_list = _load_match_list(parent["id"], base_version)
+    except DatasetExpired:
+        return None
+    new_match_ids = match_list[:len(match_list) - len(base_match_list)]
+    if len(new_match_ids) > delta_fraction * len(base_match_list):
+        return None
+    return base_version, new_match_ids
+
+def save_dataset(player_store : PlayerStatsStore, match_json : dict, match_list : List[str], dataset_id : str = None,
+                 new_match_ids : Iterable[str] = None, parent : dict = None) -> Dict[str, Union[str, int]]:
+    """
+    Saves a dataset as a new version and returns its handle.
+
+    Parameters
+    ----------
+
+    player_store : PlayerStatsStore
+            Player stats and Elo.
+    match_json : dict
+            Parsed matches keyed by match_id.
+    match_list : list
+            Match IDs, newest first.
+    dataset_id : str
+            ID of the dataset being updated, a new dataset is created if None.
+    new_match_ids : iterable
+            Matches added since the previous version, all matches are written if None.
+    parent : dict
+            Handle of the version this one was updated from. The new version is saved as a delta
+            of the parent's full base version while it adds at most delta_fraction of the base's matches.
+
+    Returns
+    -------
+
+    handle : dict
+            {"id" : dataset_id, "version" : version}
+    """
+
+    if parent is not None:
+        dataset_id = parent["id"]
+    if dataset_id is None:
+        dataset_id = str(uuid.uuid4())
+    if new_match_ids is None:
+        new_match_ids = match_json.keys()
+
+    delta = None if parent is None else _delta_base(parent, match_list)
+    version = conn.incr(_latest_key(dataset_id))
+    previous_base = conn.hget(_version_key(dataset_id, version - 1), "base") if version > 1 else None
+
+    pipe = conn.pipeline(transaction = False)
+    new_matches = {match_id : ujson.dumps(match_json[match_id]) for match_id in new_match_ids if match_id in match_json}
+    if new_matches:
+        pipe.hset(_matches_key(dataset_id), mapping = new_matches)
+    if delta is None:
+        pipe.hset(_version_key(dataset_id, version), mapping = {
+            "players" : zlib.compress(pickle.dumps(player_store, protocol = pickle.HIGHEST_PROTOCOL)),
+            "match_list" : ujson.dumps(match_list),
+            "player_name_lookup" : ujson.dumps({player_store[player]["name"] : player for player in player_store})
+        })
+        base_version = None
+    else:
+        base_version, delta_match_ids = delta
+        pipe.hset(_version_key(dataset_id, version), mapping = {
+            "base" : base_version,
+            "new_match_list" : ujson.dumps(delta_match_ids),
+            "patch" : zlib.compress(pickle.dumps(make_patch(player_store, delta_match_ids), protocol = pickle.HIGHEST_PROTOCOL))
+        })
+        pipe.expire(_version_key(dataset_id, base_version), dataset_ttl)
+    for key in (_matches_key(dataset_id), _version_key(dataset_id, version), _latest_key(dataset_id)):
+        pipe.expire(key, dataset_ttl)
+    # Sessions still reading the previous version, or the base it was a delta of, move to this one when they next load the page
+    superseded = {version - 1} if version > 1 else set()
+    if previous_base is not None:
+        superseded.add(int(previous_base))
+    for superseded_version in superseded - {base_version}:
+        pipe.expire(_version_key(dataset_id, superseded_version), superseded_ttl)
+    pipe.execute()
+
+    return {"id" : dataset_id, "version" : version}
+
+def save_matches(dataset_id : str, matches : Dict[str, dict]) -> None:
+    "Writes parsed matches to a dataset ahead of save_dataset, so large imports can be written in batches"
+    if not matches:
+        return None
+    pipe = conn.pipeline(transaction = False)
+    pipe.hset(_matches_key(dataset_id), mapping = {match_id : ujson.dumps(match) for match_id, match in matches.items()})
+    pipe.expire(_matches_key(dataset_id), dataset_ttl)
+    pipe.execute()
+
+def latest_version(dataset_id : str) -> int:
+    "Returns the latest version of a dataset, or None if it does not exist"
+    version = conn.get(_latest_key(dataset_id))
+    return None if version is None else int(version)
+
+def refresh_dataset(handle : dict) -> Dict[str, Union[str, int]]:
+    """
+    Restarts the TTL of a dataset's latest version and the keys it reads from.
+    Returns the latest version's handle, which is newer than handle if the dataset has been updated since,
+    or None if the dataset has expired.
+    """
+    version = latest_version(handle["id"])
+    if version is None:
+        return None
+    keys = [_version_key(handle["id"], version), _matches_key(handle["id"]), _latest_key(handle["id"])]
+    base = conn.hget(keys[0], "base")
+    if base is not None:
+        keys.append(_version_key(handle["id"], int(base)))
+    pipe = conn.pipeline(transaction = False)
+    for key in keys:
+        pipe.expire(key, dataset_ttl)
+    refreshed = pipe.execute()
+    # The version and, for a delta, its base have to exist
+    if not refreshed[0] or not all(refreshed[3:]):
+        return None
+    return {"id" : handle["id"], "version" : version}
+
+def hub_dataset(hub_id : str) -> Dict[str, Union[str, int]]:
+    "Returns the handle of the latest version of a hub's synced dataset, or None if it has none"
+    dataset_id = conn.get(f"hub:{hub_id}:dataset")
+    if dataset_id is None:
+        return None
+    dataset_id = dataset_id.decode()
+    version = latest_version(dataset_id)
+    return None if version is None else {"id" : dataset_id, "version" : version}
+
+def set_hub_dataset(hub_id : str, handle : dict) -> None:
+    "Records handle's dataset as the one sync jobs keep up to date for hub_id"
+    conn.set(f"hub:{hub_id}:dataset", handle["id"], ex = dataset_ttl)
+
+def register_hub(hub_id : str) -> None:
+    "Has the scheduler sync hub_id until hub_idle_ttl passes without it being fetched from the dashboard again"
+    conn.zadd("hub_activity", {hub_id : time.time()})
+
+def unregister_hub(hub_id : str) -> None:
+    "Stops the scheduler syncing hub_id, its dataset expires unless the hub is fetched again"
+    conn.zrem("hub_activity", hub_id)
+
+def registered_hubs() -> List[str]:
+    "Returns the IDs of the hubs fetched from the dashboard within hub_idle_ttl, forgetting the rest"
+    conn.zremrangebyscore("hub_activity", "-inf", time.time() - hub_idle_ttl)
+    return sorted(hub_id.decode() for hub_id in conn.zrange("hub_activity", 0, -1))
+
+def save_merged_view(view : dict) -> str:
+    "Saves a merged player view and returns its ID"
+    view_id = str(uuid.uuid4())
+    conn.set(f"merged:{view_id}", ujson.dumps(view), ex = dataset_ttl)
+    return view_id
+
+def load_merged_view(view_id : str) -> dict:
+    data = conn.get(f"merged:{view_id}")
+    if data is None:
+        raise KeyError(f"Merged view {view_id} not found")
+    return ujson.loads(data)
+
+def _fields(handle : dict, *fields : str) -> List[bytes]:
+    "Reads fields of a version's hash, raises DatasetExpired if the version has none of them"
+    data = conn.hmget(_version_key(handle["id"], handle["version"]), fields)
+    if all(value is None for value in data):
+        raise DatasetExpired(f"Dataset {handle['id']} version {handle['version']} not found")
+    return data
+
+def _matches(dataset_id : str, match_ids : List[str]) -> dict:
+    "Returns the parsed matches in match_ids keyed by match_id, in the same order, leaving out matches without stats"
+    matches = conn.hmget(_matches_key(dataset_id), match_ids) if match_ids else []
+    return {match_id : ujson.loads(match) for match_id, match in zip(match_ids, matches) if match is not None}
+
+def _players(handle : dict, base_store) -> PlayerStatsStore:
+    "Builds a version's player store, base_store returns a private copy of a delta version's base version's store"
+    players, base, new_match_list, patch = _fields(handle, "players", "base", "new_match_list", "patch")
+    if players is None:
+        player_store = base_store({"id" : handle["id"], "version" : int(base)})
+        new_match_ids = ujson.loads(new_match_list)[::-1] # Oldest first, the order matches were parsed in
+        return apply_patch(player_store, pickle.loads(zlib.decompress(patch)), _matches(handle["id"], new_match_ids))
+    player_store = pickle.loads(zlib.decompress(players))
+    if player_store.aggregates is None or player_store.match_index is None:
+        player_store.reindex(_load_matches(handle["id"], handle["version"]))
+    return player_store
+
+def checkout_players(handle : dict) -> PlayerStatsStore:
+    "Returns a private copy of a version's player store, for jobs that update it into a new version"
+    return _players(handle, checkout_players)
+
+def _copy_players(handle : dict) -> PlayerStatsStore:
+    "Copies a base version's cached store, so every delta of the base is built without reading it from Redis again"
+    return pickle.loads(pickle.dumps(load_players(handle), protocol = pickle.HIGHEST_PROTOCOL))
+
+@lru_cache(maxsize = cached_versions)
+def _load_players(dataset_id : str, version : int) -> PlayerStatsStore:
+    return _players({"id" : dataset_id, "version" : version}, _copy_players)
+
+@lru_cache(maxsize = cached_versions)
+def _load_match_list(dataset_id : str, version : int) -> List[str]:
+    match_list, base, new_match_list = _fields({"id" : dataset_id, "version" : version}, "match_list", "base", "new_match_list")
+    if match_list is None:
+        return ujson.loads(new_match_list) + _load_match_list(dataset_id, int(base))
+    return ujson.loads(match_list)
+
+@lru_cache(maxsize = cached_versions)
+def _load_matches(dataset_id : str, version : int) -> dict:
+    match_list = _load_match_list(dataset_id, version)
+    return _matches(dataset_id, match_list[::-1]) # Oldest first, the order matches were parsed in
+
+def load_players(handle : dict) -> PlayerStatsStore:
+    "Returns the player store of a dataset version, cached per process so treat it as read only"
+    return _load_players(handle["id"], handle["version"])
+
+def load_match_list(handle : dict) -> List[str]:
+    "Returns the match IDs of a dataset version, newest first"
+    return _load_match_list(handle["id"], handle["version"])
+
+def load_matches(handle : dict) -> dict:
+    "Returns every match of a dataset version keyed by match_id, cached per process so treat it as read only"
+    return _load_matches(handle["id"], handle["version"])
+
+def load_match(handle : dict, match_id : str) -> dict:
+    "Returns a single match, or None if it is not in the dataset"
+    match = conn.hget(_matches_key(handle["id"]), match_id)
+    return None if match is None else ujson.loads(match)
+
+def load_player_name_lookup(handle : dict) -> Dict[str, str]:
+    "Returns a dict of player name : player_id"
+    player_name_lookup, _ = _fields(handle, "player_name_lookup", "base")
+    if player_name_lookup is None:
+        # A delta version, names are taken from its player store
+        player_store = load_players(handle)
+        return {player_store.names[player] : player for player in player_store}
+    return ujson.loads(player_name_lookup)
+
+def snapshot_etag(handle : dict) -> str:
+    "ETag of a version's snapshot, versions never change so it only depends on the handle and the format"
+    return f"{handle['id']}-{handle['version']}-{FORMAT_VERSION}"
+
+def load_snapshot_bytes(handle : dict) -> bytes:
+    """
+    Returns a dataset version as a snapshot file, built on the first request and then kept alongside the version.
+    Raises DatasetExpired once the version has left Redis, even while this process still has it cached.
+    """
+    key = _version_key(handle["id"], handle["version"])
+    data, _, _ = _fields(handle, "snapshot", "players", "base")
+    if data is None:
+        data = dump_snapshot(load_players(handle), load_matches(handle), load_match_list(handle))
+        pipe = conn.pipeline(transaction = True)
+        pipe.hsetnx(key, "snapshot", data)
+        pipe.ttl(key)
+        _, ttl = pipe.execute()
+        if ttl == -1:
+            # The version expired while the snapshot was built and the write recreated it without a TTL
+            conn.delete(key)
+            raise DatasetExpired(f"Dataset {handle['id']} version {handle['version']} not found")
+    return data
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,68 @@
+from store import STAT_ORDER, NUMERIC_STATS, PlayerStatsStore
+from typing import Dict, List
+
+# Patches describing what updates added to a player store since a base version, so a dataset
+# version that only adds matches is stored in proportion to the new matches rather than the
+# whole hub. Matches are never changed once parsed, so a patch only ever appends. A patch is
+# a plain dict:
+#
+# {
+#     player_id : {                       every player in a match added since the base
+#         "name" : str,
+#         "stats" : {stat : List},        the player's new rows, in the old player_json format
+#         "elo" : float,                  Elo after the update
+#         "elo_history" : List[float]     Elo after each new match
+#     }
+# }
+#
+# Applying a patch to the base version's player store gives the updated player store.
+
+def make_patch(player_store : PlayerStatsStore, new_match_ids : List[str]) -> Dict[str, dict]:
+    """
+    Builds the patch for matches that have been added to player_store since a base version.
+
+    Parameters
+    ----------
+
+    player_store : PlayerStatsStore
+            Player stats and Elo after the update.
+    new_match_ids : list
+            Match IDs added since the base version. Matches are applied in order, so they are
+            the last rows of every player that played in them.
+    """
+
+    new_match_ids = set(new_match_ids)
+    patch = {}
+    for player, rows in player_store.player_rows.items():
+        count = 0
+        while count < len(rows) and player_store.match_ids[player_store.match_codes[rows[-1 - count]]] in new_match_ids:
+            count += 1
+        if not count:
+            continue
+        patch[player] = {
+            "name" : player_store.names[player],
+            "stats" : {stat : list(player_store.column(player, stat)[-count:]) for stat in STAT_ORDER},
+            "elo" : player_store.elos[player],
+            "elo_history" : player_store.elo_histories[player][-count:].tolist()
+        }
+    return patch
+
+def apply_patch(player_store : PlayerStatsStore, patch : Dict[str, dict], matches : Dict[str, dict]) -> PlayerStatsStore:
+    """
+    Applies a patch to the base version's player_store in place and returns it.
+    matches holds the parsed matches added since the base, oldest first, for the aggregates and the match index.
+    """
+    for player, data in patch.items():
+        stats = data["stats"]
+        for i in range(len(stats["Match ID"])):
+            statistics = {stat : stats[stat][i] for stat in NUMERIC_STATS if stat != "Number of Rounds"}
+            player_store.append_stats(player, data["name"], stats["Match ID"][i], stats["Number of Rounds"][i], stats["Map"][i], statistics)
+        player_store.elos[player] = data["elo"]
+        player_store.elo_histories[player].extend(data["elo_history"])
+    for match_id, match in matches.items():
+        player_store.index_match(match_id, match)
+    player_store.compact()
+    return player_store
+
+if __name__ == "__main__":
+    pass
@@ -1,6 +1,9 @@
-from itertools import combinations
+from balance import balance
+import gc
+import numpy as np
 import os
 import pandas as pd
+from typing import Dict, List, Tuple
 
 api_key = os.environ["API_KEY"]
 
@@ -8,6 +11,19 @@ class Elo:
     
     performance_average = 0.3
     max_elo_difference = 400
+    # The max and min elo rewards for the whole team if they win
+    max_elo_reward = 245
+    min_elo_reward = 5
+    # Coefficients of performance_metric
+    performance_weights = {
+        "kpr" : 0.3591,
+        "dpr" : 0.5329,
+        "impact" : 0.2372,
+        "constant" : 0.1587,
+        "impact_kpr" : 2.13,
+        "impact_assists" : 0.42,
+        "impact_constant" : 0.41
+    }
 
     def __init__(self, team_one, team_two, match_stats, player_dict):
 
@@ -37,9 +53,8 @@ class Elo:
     def _team_elo_win(self, team):
         # The difference threshold at which max and min elo rewards are
         max_allowed_difference = self.max_elo_difference
-        # The max and min elo rewards for the whole team if they win
-        max_elo_reward = 245
-        min_elo_reward = 5
+        max_elo_reward = self.max_elo_reward
+        min_elo_reward = self.min_elo_reward
         standard_elo_reward = (max_elo_reward + min_elo_reward) / 2
         elo_scaling = (standard_elo_reward - min_elo_reward) / max_allowed_difference
         team_elo = 0
@@ -74,9 +89,10 @@ class Elo:
         dpr = self.match_stats[player]["Deaths"] / rounds
         assist_per_round = self.match_stats[player]["Assists"] / rounds
 
-        impact = 2.13 * kpr + 0.42 * assist_per_round -0.41
+        weights = self.performance_weights
+        impact = weights["impact_kpr"] * kpr + weights["impact_assists"] * assist_per_round - weights["impact_constant"]
 
-        performance_rating = 0.3591*kpr -0.5329 * dpr + 0.2372 * impact + 0.1587
+        performance_rating = weights["kpr"] * kpr - weights["dpr"] * dpr + weights["impact"] * impact + weights["constant"]
 
         # performance_rating = self.match_stats[player]["K/R Ratio"]
 
@@ -117,29 +133,314 @@ class Elo:
                 actual)
 
     @classmethod
-    def even_match(self, players):
-        player_names = set([player["name"] for player in players])
-        player_elos = [player["elo"] for player in players]
+    def even_match(self, players, team_size = 5, top_k = 5, **constraints):
+        """
+        Returns the top_k most even matches as a DataFrame. If more than two teams' worth of players are
+        given, the closest rated group is picked first and everyone else is listed as sitting out.
+        Players can be locked to a team, kept together or split up by name, see balance.balance.
+        """
         elo_lookup = {player["name"] : player["elo"] for player in players}
+        matches, bench = balance(elo_lookup, team_size, top_k, **constraints)
 
-        target = sum(player_elos) / 2
-        team_elo = []
-        idx = []
-        team_list = []
-        team_two_list = []
-        
-        for i, team in enumerate(list(combinations(player_names, 5))):
-            elo = abs(sum([elo_lookup[player] for player in team]) - target)
-            team_elo.append(elo)
-            idx.append(i)
-            team_one = [str(player) for player in team]
-            team_list.append(", ".join(team_one))
-            team_two = [str(player) for player in player_names.difference(team)]
-            team_two_list.append(", ".join(team_two))
-
-        data = pd.DataFrame({"Elo Difference" : team_elo, "Team 1" : team_list, "Team 2" : team_two_list}, index = idx).sort_values(by = "Elo Difference", ascending = True).head(5)
+        data = pd.DataFrame({
+            "Elo Difference" : [difference for difference, _, _ in matches],
+            "Team 1" : [", ".join([str(player) for player in team_one]) for _, team_one, _ in matches],
+            "Team 2" : [", ".join([str(player) for player in team_two]) for _, _, team_two in matches]
+        })
+        if bench:
+            data["Sitting Out"] = ", ".join([str(player) for player in bench])
 
         return data
 
+def match_columns(match_json : dict, match_ids : List[str], team_size : int = None) -> Tuple[Dict[str, np.ndarray], List[str]]:
+    """
+    Converts parsed matches into the columnar arrays used by replay_elo.
+
+    Parameters
+    ----------
+
+    match_json : dict
+            Parsed matches keyed by match_id.
+    match_ids : list
+            The matches to convert, oldest first.
+    team_size : int
+            Roster width, teams with fewer players are padded. Defaults to the largest team.
+
+    Returns
+    -------
+
+    columns : dict
+            "roster" (n, 2, team_size) player indexes with -1 for empty slots, "kpr", "deaths", "assists"
+            and "rounds" (n, 2, team_size) stats, "winner" (n,) 1 or 2.
+    players : list
+            Player IDs, position i is player index i.
+    """
+
+    n = len(match_ids)
+    if team_size is None:
+        team_size = max([len(match_json[match_id][team]) for match_id in match_ids for team in ("team_one", "team_two")], default = 5)
+    players = []
+    player_index = {}
+    roster = np.full((n, 2, team_size), -1, dtype = np.int64)
+    stats = {stat : np.zeros((n, 2, team_size)) for stat in ("kpr", "deaths", "assists", "rounds")}
+    winner = np.zeros(n, dtype = np.int64)
+
+    for i, match_id in enumerate(match_ids):
+        match = match_json[match_id]
+        winner[i] = match["winner"]
+        for team, team_players in enumerate((match["team_one"], match["team_two"])):
+            for slot, player in enumerate(team_players):
+                if player not in player_index:
+                    player_index[player] = len(players)
+                    players.append(player)
+                player_stats = match["player_stats"][player]
+                roster[i, team, slot] = player_index[player]
+                stats["kpr"][i, team, slot] = player_stats["K/R Ratio"]
+                stats["deaths"][i, team, slot] = player_stats["Deaths"]
+                stats["assists"][i, team, slot] = player_stats["Assists"]
+                stats["rounds"][i, team, slot] = player_stats["Number of Rounds"]
+
+    stats["roster"] = roster
+    stats["winner"] = winner
+    return stats, players
+
+def _waves(roster : List[List[List[int]]]) -> List[int]:
+    "Assigns each match to the earliest wave after every previous match of its players, matches in a wave share no players"
+    last_wave = {}
+    waves = []
+    for teams in roster:
+        wave = 1 + max([last_wave.get(player, -1) for team in teams for player in team], default = -1)
+        waves.append(wave)
+        for team in teams:
+            for player in team:
+                last_wave[player] = wave
+    return waves
+
+def _ordered_sum(values : np.ndarray) -> np.ndarray:
+    "Sums over the last axis one slot at a time, the same order as the builtin sum, so results match Elo exactly"
+    total = np.zeros(values.shape[:-1])
+    for slot in range(values.shape[-1]):
+        total = total + values[..., slot]
+    return total
+
+class EloParameters:
+    """
+    A set of Elo parameters, defaults to the class attributes of Elo. Any of performance_average,
+    max_elo_difference, max_elo_reward, min_elo_reward or a key of Elo.performance_weights can be overridden.
+    """
+
+    names = ("performance_average", "max_elo_difference", "max_elo_reward", "min_elo_reward")
+
+    def __init__(self, **overrides):
+        unknown = set(overrides) - set(self.names) - set(Elo.performance_weights)
+        if unknown:
+            raise TypeError(f"Unknown Elo parameters {sorted(unknown)}")
+        for name in self.names:
+            setattr(self, name, overrides.get(name, getattr(Elo, name)))
+        self.performance_weights = {name : overrides.get(name, weight) for name, weight in Elo.performance_weights.items()}
+        self.standard_elo_reward = (self.max_elo_reward + self.min_elo_reward) / 2
+        self.elo_scaling = (self.standard_elo_reward - self.min_elo_reward) / self.max_elo_difference
+
+    def to_dict(self) -> dict:
+        "Returns every parameter as a flat dict"
+        return {**{name : getattr(self, name) for name in self.names}, **self.performance_weights}
+
+def _replay_match(teams : List[List[int]], actual : List[List[float]], team_one_wins : bool, ratings : List[float], bounds : EloParameters) -> tuple:
+    """
+    Replays a single match with Python floats, used for waves too small to be worth vectorising.
+    Mirrors Elo operation for operation, min and max are written out as comparisons for speed.
+    """
+    max_elo_reward = bounds.max_elo_reward
+    min_elo_reward = bounds.min_elo_reward
+    max_elo_difference = bounds.max_elo_difference
+    target_scale = max_elo_difference * 2
+    performance_average = bounds.performance_average
+
+    elos = [[ratings[player] for player in team] for team in teams]
+    team_elo = [sum(elos[0]) / len(elos[0]), sum(elos[1]) / len(elos[1])]
+    total_elo = 0
+    for team in elos:
+        for elo in team:
+            total_elo += elo
+    match_elo = total_elo / (len(elos[0]) + len(elos[1]))
+    team_elo_win = []
+    for t in (0, 1):
+        reward = bounds.standard_elo_reward - ((team_elo[t] - match_elo) * bounds.elo_scaling)
+        reward = max_elo_reward if max_elo_reward < reward else reward
+        reward = min_elo_reward if min_elo_reward > reward else reward
+        team_elo_win.append(reward / len(elos[t]))
+
+    changes = ([], [])
+    targets = ([], [])
+    for t in (0, 1):
+        team_targets = targets[t]
+        for elo in elos[t]:
+            target_multiplier = 1 + ((elo - match_elo) / target_scale)
+            target_multiplier = max_elo_difference if max_elo_difference < target_multiplier else target_multiplier
+            target_multiplier = -max_elo_difference if -max_elo_difference > target_multiplier else target_multiplier
+            team_targets.append(performance_average * target_multiplier)
+        team_actual = actual[t]
+        balancer = sum([team_actual[slot] / team_targets[slot] for slot in range(len(team_targets))]) / len(team_targets)
+        if team_one_wins == (t == 0):
+            win_reward = team_elo_win[t]
+            loss_reward = None
+        else:
+            loss_reward = team_elo_win[1 - t]
+        team_elos = elos[t]
+        team_changes = changes[t]
+        for slot, player in enumerate(teams[t]):
+            target = team_targets[slot] * balancer
+            performance_ratio = team_actual[slot] / target
+            performance_ratio = 0.5 if 0.5 > performance_ratio else performance_ratio
+            performance_ratio = 1.5 if 1.5 < performance_ratio else performance_ratio
+            if loss_reward is None:
+                elo_change = performance_ratio * win_reward
+            else:
+                elo_change = - (abs(performance_ratio - 2)) * loss_reward
+            team_changes.append(elo_change)
+            team_targets[slot] = target
+            ratings[player] = team_elos[slot] + elo_change
+
+    return elos, changes, targets, match_elo, team_elo
+
+def _replay_wave(idx : np.ndarray, columns : Dict[str, np.ndarray], actual : np.ndarray, ratings : np.ndarray, bounds : EloParameters) -> tuple:
+    "Replays a wave of matches with no players in common at once"
+    wave_roster = columns["roster"][idx]
+    wave_mask = wave_roster >= 0
+    counts = wave_mask.sum(axis = 2)
+    elo = np.where(wave_mask, ratings[np.where(wave_mask, wave_roster, 0)], 0)
+
+    team_elo = _ordered_sum(elo) / counts
+    match_elo = _ordered_sum(elo.reshape(len(idx), -1)) / counts.sum(axis = 1)
+    team_elo_difference = team_elo - match_elo[:, None]
+    team_elo_win = np.minimum(bounds.standard_elo_reward - (team_elo_difference * bounds.elo_scaling), bounds.max_elo_reward)
+    team_elo_win = np.maximum(team_elo_win, bounds.min_elo_reward) / counts
+
+    player_elo_diff = elo - match_elo[:, None, None]
+    target_multiplier = np.minimum(1 + (player_elo_diff / (bounds.max_elo_difference * 2)), bounds.max_elo_difference)
+    performance_target = np.where(wave_mask, bounds.performance_average * np.maximum(target_multiplier, -bounds.max_elo_difference), 1)
+
+    wave_actual = actual[idx]
+    balancer = _ordered_sum(np.where(wave_mask, wave_actual / performance_target, 0)) / counts
+    target = performance_target * balancer[:, :, None]
+    performance_ratio = np.minimum(1.5, np.maximum(0.5, wave_actual / target))
+
+    team_one_wins = columns["winner"][idx] == 1
+    wins = np.stack([team_one_wins, ~team_one_wins], axis = 1)[:, :, None]
+    own_win = team_elo_win[:, :, None]
+    other_win = team_elo_win[:, ::-1, None]
+    elo_change = np.where(wins, performance_ratio * own_win, - (np.abs(performance_ratio - 2)) * other_win)
+    elo_change = np.where(wave_mask, elo_change, 0)
+
+    ratings[wave_roster[wave_mask]] = elo[wave_mask] + elo_change[wave_mask]
+    return elo, elo_change, np.where(wave_mask, target, 0), match_elo, team_elo
+
+def replay_elo(columns : Dict[str, np.ndarray], num_players : int, initial_elo : float = 1000, min_wave : int = 32,
+               parameters : EloParameters = None) -> Dict[str, np.ndarray]:
+    """
+    Replays Elo over a whole match history, giving the same results as applying Elo.elo_changes one match at a time.
+
+    Performance ratings do not depend on Elo so they are computed for every match at once. The rating pass
+    then handles a wave of matches with no players in common per step, with all per match work vectorised.
+    Waves smaller than min_wave, common when a small pool of players plays every match, are replayed one match
+    at a time with Python floats as NumPy's per call overhead would outweigh the vectorisation.
+
+    Parameters
+    ----------
+
+    columns : dict
+            Output of match_columns, matches oldest first.
+    num_players : int
+            Number of distinct player indexes in the roster.
+    initial_elo : float
+            Elo of a player before their first match.
+    min_wave : int
+            Smallest wave that is vectorised.
+    parameters : EloParameters
+            Parameters to replay with, defaults to the ones Elo uses.
+
+    Returns
+    -------
+
+    timeline : dict
+            "elo", "elo_change", "performance_target" and "performance_actual" (n, 2, team_size) per roster slot,
+            with "elo" being the Elo before the match and empty slots 0, "match_elo" (n,), "team_elo" (n, 2) and
+            "final_elo" (num_players,).
+    """
+
+    # The replay allocates many short lived lists, none of them cyclic, and each collection
+    # would walk every object the worker holds, so the cyclic collector is paused
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _replay_elo(columns, num_players, initial_elo, min_wave, parameters if parameters is not None else EloParameters())
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+def _replay_elo(columns : Dict[str, np.ndarray], num_players : int, initial_elo : float, min_wave : int, bounds : EloParameters) -> Dict[str, np.ndarray]:
+    "Body of replay_elo, run with the cyclic collector paused"
+    roster = columns["roster"]
+    n, _, team_size = roster.shape
+    mask = roster >= 0
+
+    # Elo.performance_metric for every slot of every match
+    weights = bounds.performance_weights
+    rounds = np.where(mask, columns["rounds"], 1)
+    kpr = columns["kpr"]
+    dpr = columns["deaths"] / rounds
+    assist_per_round = columns["assists"] / rounds
+    impact = weights["impact_kpr"] * kpr + weights["impact_assists"] * assist_per_round - weights["impact_constant"]
+    actual = np.where(mask, weights["kpr"] * kpr - weights["dpr"] * dpr + weights["impact"] * impact + weights["constant"], 0)
+
+    teams_list = [[[player for player in team if player >= 0] for team in teams] for teams in roster.tolist()]
+    actual_list = actual.tolist()
+    team_one_wins_list = (columns["winner"] == 1).tolist()
+
+    waves = _waves(teams_list)
+    wave_members = {}
+    for i, wave in enumerate(waves):
+        wave_members.setdefault(wave, []).append(i)
+
+    ratings = [float(initial_elo)] * num_players
+    keys = ("elo", "elo_change", "performance_target")
+    flat = {key : [0.0] * (n * 2 * team_size) for key in keys}
+    match_elo = [0.0] * n
+    team_elo = [[0.0, 0.0] for _ in range(n)]
+    vectorised = []
+
+    for wave in sorted(wave_members):
+        members = wave_members[wave]
+        if len(members) >= min_wave:
+            idx = np.asarray(members)
+            ratings = np.asarray(ratings)
+            vectorised.append((idx, _replay_wave(idx, columns, actual, ratings, bounds)))
+            ratings = ratings.tolist()
+            continue
+
+        for i in members:
+            teams = teams_list[i]
+            match_actual = [actual_list[i][t][:len(teams[t])] for t in range(2)]
+            results = _replay_match(teams, match_actual, team_one_wins_list[i], ratings, bounds)
+            for key, values in zip(keys, results):
+                for t in range(2):
+                    base = (i * 2 + t) * team_size
+                    flat[key][base:base + len(values[t])] = values[t]
+            match_elo[i] = results[3]
+            team_elo[i] = results[4]
+
+    timeline = {key : np.array(flat[key]).reshape(roster.shape) for key in keys}
+    timeline["performance_actual"] = actual
+    timeline["match_elo"] = np.array(match_elo)
+    timeline["team_elo"] = np.array(team_elo)
+    for idx, results in vectorised:
+        for key, values in zip(keys, results):
+            timeline[key][idx] = values
+        timeline["match_elo"][idx] = results[3]
+        timeline["team_elo"][idx] = results[4]
+    timeline["final_elo"] = np.asarray(ratings)
+
+    return timeline
+
 if __name__ == "__main__":
     pass
\ No newline at end of file
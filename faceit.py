@@ -1,12 +1,14 @@
-import aiohttp
 import asyncio
-from elo import Elo
+from cache import MatchCache
+from concurrent.futures import ProcessPoolExecutor
+from elo import Elo, match_columns, replay_elo
+from fetcher import Fetcher
 import logging
 import os
-import requests
+from progress import ProgressReporter
 from rq import get_current_job
-from typing import Dict, List, Union
-import ujson
+from store import PlayerStatsStore
+from typing import Dict, List, Set, Union
 
 # player_json takes the form
 # player_id : {
@@ -48,37 +50,173 @@ import ujson
 # }
 
 api_key = os.environ["API_KEY"]
+page_size = 100 # Maximum number of matches the hub matches endpoint returns per call
+page_window = int(os.environ.get("FACEIT_PAGE_WINDOW", 10)) # Number of pages requested concurrently
+stream_window = int(os.environ.get("FACEIT_STREAM_WINDOW", 200)) # Maximum number of matches held ahead of the next match to parse
+prefetch_workers = int(os.environ.get("FACEIT_PREFETCH_WORKERS", 20)) # Matches downloaded at once while the hub is paged through
+parse_processes = int(os.environ.get("FACEIT_PARSE_PROCESSES", os.cpu_count() or 1)) # Processes decoding and parsing match stats
+parse_pool_min_matches = 200 # Smaller jobs parse in the event loop, starting processes costs more than it saves
 
 TypeJSON = Union[Dict[str, 'JSON'], List['JSON'], int, str, float, bool, None]
 
-async def get_match(session, url):
-    "Makes a single get request to retrieve match stats"
-    async with session.get(url, headers = {"Authorization" : "Bearer " + api_key}) as resp:
-        match = await resp.json(loads = ujson.loads)
-        try:
-            return match["rounds"][0]
-        except:
-            return None
-
-async def match_loop(match_list : List[str]) -> TypeJSON:
-    "Loops through match_list and makes asynchronus get requests to retrieve match data"
+def faceit_fetcher() -> Fetcher:
+    "Returns a Fetcher authorised against the Faceit data API"
+    return Fetcher(headers = {"Authorization" : "Bearer " + api_key})
 
-    async with aiohttp.ClientSession(json_serialize = ujson.dumps) as session:
-
-        tasks = []
-        for match_id in match_list:
-            url = f"https://open.faceit.com/data/v4/matches/{match_id}/stats"
-            tasks.append(asyncio.ensure_future(get_match(session, url)))
+async def get_match(fetcher : Fetcher, match_id : str) -> TypeJSON:
+    "Makes a single get request to retrieve match stats, returns None if the match has no stats"
+    match = await fetcher.get_json(f"https://open.faceit.com/data/v4/matches/{match_id}/stats")
+    try:
+        return match["rounds"][0]
+    except (KeyError, IndexError, TypeError):
+        return None
 
-        match_data = await asyncio.gather(*tasks)
-        for match in match_data:
+class Prefetcher:
+    """
+    Downloads match stats into a MatchCache in the background, so stats downloads overlap hub pagination.
+
+    stream_matches claims each match before reading it. A match already being prefetched is awaited
+    rather than requested twice, and one not started yet is left for stream_matches to fetch itself,
+    so the oldest matches, which are parsed first but paged last, never wait behind the queue.
+    """
+
+    def __init__(self, cache : MatchCache, fetcher : Fetcher, workers : int = prefetch_workers):
+        self.cache = cache
+        self.fetcher = fetcher
+        self.queue = asyncio.Queue()
+        self.started = {} # match_id : future, done once the match is cached or found to have no stats
+        self.claimed = set()
+        self.no_stats = set()
+        self.tasks = [asyncio.ensure_future(self._work()) for _ in range(workers)]
+
+    def add(self, match_ids : List[str]) -> None:
+        "Queues the matches in match_ids that aren't cached yet"
+        for match_id in self.cache.missing(match_ids):
+            self.queue.put_nowait(match_id)
+
+    async def _work(self) -> None:
+        while True:
+            match_id = await self.queue.get()
+            if match_id in self.claimed:
+                continue
+            future = self.started[match_id] = asyncio.get_running_loop().create_future()
             try:
-                print(match["match_id"])
-            except TypeError:
-                print("404")
-        print(len(match_data))
-    
-    return match_data
+                data = await get_match(self.fetcher, match_id)
+                if data is None:
+                    self.no_stats.add(match_id)
+                else:
+                    self.cache.put(match_id, data)
+            except Exception as e:
+                logging.warning(f"Prefetching {match_id} failed, it will be fetched when parsed: {e!r}")
+            finally:
+                future.set_result(None)
+
+    async def claim(self, match_id : str) -> bool:
+        "Waits for match_id if it is being prefetched and stops it being prefetched later, returns False if it has no stats"
+        self.claimed.add(match_id)
+        future = self.started.get(match_id)
+        if future is not None:
+            await future
+        return match_id not in self.no_stats
+
+    def close(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+
+class ParsePool:
+    """
+    Process pool for parse_matches, only started once the matches counted against it reach min_matches.
+    Hubs synced together share one, so small hubs parse in the event loop unless their total is large.
+    """
+
+    def __init__(self, processes : int = parse_processes, min_matches : int = parse_pool_min_matches):
+        self.processes = processes
+        self.min_matches = min_matches
+        self.matches = 0
+        self.executor = None
+
+    def reserve(self, n : int) -> ProcessPoolExecutor:
+        "Counts n more matches to parse, returns the executor to parse them in or None to parse in the event loop"
+        self.matches += n
+        if self.executor is None and self.processes > 1 and self.matches >= self.min_matches:
+            self.executor = ProcessPoolExecutor(self.processes)
+        return self.executor
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+class ReorderBuffer:
+    "Holds items that finish out of order and releases them in sequence"
+
+    def __init__(self, start : int = 0):
+        self.next_index = start
+        self.pending = {}
+
+    def push(self, index : int, item) -> list:
+        "Adds the item at index and returns every item that is now ready, in order"
+        self.pending[index] = item
+        ready = []
+        while self.next_index in self.pending:
+            ready.append(self.pending.pop(self.next_index))
+            self.next_index += 1
+        return ready
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+def parse_payload(match_id : str, blob : bytes):
+    "Decodes a compressed match cache payload and parses it, a top level function so a process pool can run it"
+    return Match.parse(match_id, MatchCache.decode(blob))
+
+async def stream_matches(match_list : List[str], cache : MatchCache, fetcher : Fetcher, window : int = stream_window,
+                         executor : ProcessPoolExecutor = None, prefetcher : Prefetcher = None):
+    """
+    Async generator yielding (match_id, Match) in match_list order, the Match is None if the match has no stats.
+
+    Stats are read from the cache or downloaded and parsed as soon as they arrive, then passed through a
+    ReorderBuffer so order dependent work such as Elo can consume them. Matches are only started while they
+    are within window of the next match to be yielded, which bounds the memory held by the buffer.
+
+    If executor is given, decoding and parsing run in its processes and only the compressed payload and the
+    parsed Match cross between processes. Parsing doesn't depend on match order, Elo is left to the consumer.
+    If prefetcher is given, matches it is already downloading are awaited instead of requested again.
+    """
+
+    loop = asyncio.get_running_loop()
+
+    async def parse(index, match_id):
+        if prefetcher is not None and not await prefetcher.claim(match_id):
+            return index, (match_id, None)
+        blob = cache.get_raw(match_id)
+        if blob is None:
+            data = await get_match(fetcher, match_id)
+            if data is None:
+                return index, (match_id, None)
+            blob = MatchCache.encode(data)
+            cache.put_raw(match_id, blob)
+            if executor is None:
+                return index, (match_id, Match.parse(match_id, data))
+        if executor is None:
+            return index, (match_id, parse_payload(match_id, blob))
+        return index, (match_id, await loop.run_in_executor(executor, parse_payload, match_id, blob))
+
+    buffer = ReorderBuffer()
+    pending = set()
+    next_index = 0
+    try:
+        while next_index < len(match_list) or pending:
+            while next_index < len(match_list) and next_index < buffer.next_index + window:
+                pending.add(asyncio.ensure_future(parse(next_index, match_list[next_index])))
+                next_index += 1
+            done, pending = await asyncio.wait(pending, return_when = asyncio.FIRST_COMPLETED)
+            for task in done:
+                for parsed_match in buffer.push(*task.result()):
+                    yield parsed_match
+    finally:
+        for task in pending:
+            task.cancel()
 
 class HubMatches:
 
@@ -86,22 +224,26 @@ class HubMatches:
         self.hub_id = hub_id
         self.player_json = player_json
         self.match_json = match_json
-        if player_json is None:
-            self.player_json = {}
         if match_json is None:
             self.match_json = {}
+        if player_json is None:
+            self.player_json = PlayerStatsStore()
+        elif not isinstance(player_json, PlayerStatsStore):
+            self.player_json = PlayerStatsStore.from_json(player_json, self.match_json)
 
-    def _limited_match_list(self, offset : int, limit : int) -> List[str]:
+    async def _limited_match_list(self, fetcher : Fetcher, offset : int, limit : int) -> List[str]:
         """
-        Returns a list containing up to 200 match IDs after the offset from a specified Faceit Hub.
+        Returns a list containing up to 100 match IDs after the offset from a specified Faceit Hub.
 
         Paramters
         ---------
 
+        fetcher : Fetcher
+                Session used to make the request.
         offset : int
                 The number of the earliest match to fetch. 
         limit : int
-                The number of matches to fetch per api call. Maximum is 200.
+                The number of matches to fetch per api call. Maximum is 100.
 
         Returns
         -------
@@ -111,109 +253,199 @@ class HubMatches:
         """
 
         url = f"https://open.faceit.com/data/v4/hubs/{self.hub_id}/matches?type=past&offset={offset}&limit={limit}"
-        response = requests.get(url, headers = {"Authorization" : "Bearer " + api_key})
-        data = response.json()
-        
-        match_id_list = []
-        
-        for item in data["items"]:
-            match_id_list.append(item["match_id"])
-        return match_id_list
+        data = await fetcher.get_json(url)
+        if data is None:
+            return []
 
-    def get_full_match_list(self, offset : int, limit : int) -> List[str]:
+        return [item["match_id"] for item in data["items"]]
+
+    async def match_list_pages(self, fetcher : Fetcher, offset : int, limit : int, window_size : int = page_window):
         """
-        Returns a list containing all Match IDs from a specified Faceit Hub.
+        Async generator yielding pages of match IDs in hub order, newest first.
 
-        Paramters
-        ---------
+        Pages are requested window_size at a time over the shared session, iteration stops
+        at the first page shorter than requested or once limit matches have been returned.
+        """
 
-        offset : int
-                The number of the earliest match to fetch
-        actual_limit : int
-                The number of matches to fetch in total.
+        while limit > 0:
+            window = []
+            for i in range(window_size):
+                page_limit = min(page_size, limit - i * page_size)
+                if page_limit <= 0:
+                    break
+                window.append((offset + i * page_size, page_limit))
+
+            pages = await asyncio.gather(*[self._limited_match_list(fetcher, page_offset, page_limit) for page_offset, page_limit in window])
+
+            for (page_offset, page_limit), match_id_list in zip(window, pages):
+                if match_id_list:
+                    yield match_id_list
+                if len(match_id_list) < page_limit:
+                    return
+
+            offset += sum(page_limit for _, page_limit in window)
+            limit -= sum(page_limit for _, page_limit in window)
+
+    async def new_match_ids(self, fetcher : Fetcher, offset : int, limit : int, known_match_ids : Set[str]) -> List[str]:
+        """
+        Pages through the hub newest first, one page at a time, and stops at the first page
+        containing a match that is already known.
 
         Returns
         -------
 
-        full_match_list : list
-                List containing all Match IDs from the specified Faceit Hub.
+        new_match_id_list : list
+                IDs of the matches not in known_match_ids, newest first.
         """
-        
-        full_match_list = []
-        
-        # Could this be removed?
-        while True:
-            
-            if limit <= 100:
-                match_id_list = self._limited_match_list(offset, limit)
-                full_match_list.extend(match_id_list)
-                break
-                
-            match_id_list = self._limited_match_list(offset, 100)
-            
-            if len(match_id_list) == 0:
+
+        new_match_id_list = []
+        async for match_id_list in self.match_list_pages(fetcher, offset, limit, window_size = 1):
+            new_match_id_list.extend(match_id for match_id in match_id_list if match_id not in known_match_ids)
+            if any(match_id in known_match_ids for match_id in match_id_list):
                 break
 
-            offset += 100
-            limit -= 100
-            full_match_list.extend(match_id_list)
+        return new_match_id_list
+
+    def recompute_elo(self, match_id_list : List[str]) -> None:
+        """
+        Recomputes every match's Elo data and every player's Elo from scratch with replay_elo,
+        giving the same results as parsing the matches one at a time.
+
+        Parameters
+        ----------
+
+        match_id_list : list
+                Match IDs, newest first.
+        """
 
-            
-        return full_match_list
+        match_ids = [match_id for match_id in match_id_list[::-1] if match_id in self.match_json]
+        columns, players = match_columns(self.match_json, match_ids)
+        timeline = replay_elo(columns, len(players))
+
+        elo_histories = {player : [] for player in players}
+        for i, match_id in enumerate(match_ids):
+            match = self.match_json[match_id]
+            match["match_elo"] = timeline["match_elo"][i].item()
+            match["team_one_elo"] = timeline["team_elo"][i, 0].item()
+            match["team_two_elo"] = timeline["team_elo"][i, 1].item()
+            for team, team_players in enumerate((match["team_one"], match["team_two"])):
+                for slot, player in enumerate(team_players):
+                    elo = timeline["elo"][i, team, slot].item()
+                    elo_change = timeline["elo_change"][i, team, slot].item()
+                    match["player_elo_data"][player] = {
+                        "Elo" : elo,
+                        "Elo Change" : elo_change,
+                        "Performance Target" : timeline["performance_target"][i, team, slot].item(),
+                        "Performance Actual" : timeline["performance_actual"][i, team, slot].item()
+                    }
+                    elo_histories[player].append(elo + elo_change)
+
+        for i, player in enumerate(players):
+            self.player_json.set_elo(player, timeline["final_elo"][i].item(), elo_histories[player])
+        self.player_json.reindex({match_id : self.match_json[match_id] for match_id in match_ids})
 
     def parse_match(self, match_id : str, match_data) -> None:
 
         """
         Parses player and match data for a single match, updates self.match_json and self.player_json
         """
-        Player.parse_match_data(match_id, match_data, self.player_json)
-        Match.full_parse(match_id, match_data, self.match_json, self.player_json)
+        self.apply_match(Match.parse(match_id, match_data))
+
+    def apply_match(self, current_match, elo : bool = True) -> None:
+        """
+        Adds an already parsed match to self.player_json and self.match_json, must be called in match order.
+        With elo False only the stats are added, recompute_elo fills in Elo once every match is in.
+        """
+        if current_match is None:
+            return None
+        Player.parse_match(current_match, self.player_json)
+        if elo:
+            Match.apply(current_match, self.match_json, self.player_json)
+        else:
+            current_match.json_update(self.match_json)
+
+    async def parse_matches(self, fetcher : Fetcher, match_id_list : List[str], progress : ProgressReporter,
+                            pool : ParsePool = None, window : int = stream_window, prefetcher : Prefetcher = None,
+                            elo : bool = True) -> None:
+        """
+        Streams the matches in match_id_list, oldest first, and applies them as they become ready.
+        Large jobs parse across parse_processes processes while Elo is applied here, one match at a time in order.
+        A shared ParsePool can be passed in when several hubs are parsed at once.
+        With elo False Elo is left for recompute_elo, see apply_match.
+        """
+        cache = MatchCache()
+        progress.add_length(len(match_id_list))
+        own_pool = pool is None
+        if own_pool:
+            pool = ParsePool()
+        executor = pool.reserve(len(match_id_list))
+        try:
+            async for match_id, current_match in stream_matches(match_id_list, cache, fetcher, window, executor, prefetcher):
+                logging.debug(match_id)
+                self.apply_match(current_match, elo)
+                progress.advance()
+        finally:
+            if own_pool:
+                pool.shutdown()
+        progress.flush()
+
+    async def fetch_all(self, fetcher : Fetcher, offset : int, limit : int, progress : ProgressReporter, **parse_options) -> List[str]:
+        """
+        Parses every match in the hub over fetcher and returns the match IDs, newest first.
+        Stats start downloading as each page of match IDs arrives, while later pages are still being requested.
+        Elo is replayed over the whole history once every match is in, rather than applied match by match.
+        """
+        prefetcher = Prefetcher(MatchCache(), fetcher)
+        try:
+            match_id_list = []
+            async for page in self.match_list_pages(fetcher, offset, limit):
+                match_id_list.extend(page)
+                prefetcher.add(page)
+
+            # The hub lists matches newest first, Elo has to be applied oldest first
+            await self.parse_matches(fetcher, match_id_list[::-1], progress, prefetcher = prefetcher, elo = False, **parse_options)
+        finally:
+            prefetcher.close()
+        self.recompute_elo(match_id_list)
+        self.player_json.compact()
+
+        return match_id_list
+
+    async def fetch_new(self, fetcher : Fetcher, offset : int, limit : int, old_match_id_list : List[str],
+                        progress : ProgressReporter, **parse_options) -> List[str]:
+        "Parses the matches newer than old_match_id_list over fetcher and returns the full match ID list, newest first"
+        new_match_id_list = await self.new_match_ids(fetcher, offset, limit, set(old_match_id_list))
+        await self.parse_matches(fetcher, new_match_id_list[::-1], progress, **parse_options) # Reversing to maintain order
+        self.player_json.compact()
+
+        return new_match_id_list + old_match_id_list
 
     def full_match_loop(self, offset : int, limit : int) -> List[str]:
         """
         Parses player and match data for all matches, updates self.match_json and self.player_json
         """
-        job = get_current_job()
-        job.meta["progress"] = job.meta.get("progress", 0)
-        job.save_meta()
-     
-        match_id_list = self.get_full_match_list(offset, limit)
-        match_data = asyncio.run(match_loop(match_id_list))
-
-        job.meta["length"] = len(match_id_list)
-        job.save_meta()
-        
-        for match_id, data in zip(match_id_list[::-1], match_data[::-1]): # Which way?
-            logging.debug(match_id)
-            self.parse_match(match_id, data)
-            job.meta["progress"] += 1
-            job.save_meta()
+        progress = ProgressReporter(get_current_job())
 
-        return match_id_list
+        async def parse():
+            async with faceit_fetcher() as fetcher:
+                return await self.fetch_all(fetcher, offset, limit, progress)
+
+        return asyncio.run(parse())
         
     def partial_match_loop(self, offset : int, limit : int, old_match_id_list : List[str]) -> List[str]:
         
         """
-        Checks the hub matches and compares the IDs to matches already parsed to only get
-        new match IDs, then parses through the new match IDs and adds them to the list.
+        Pages through the hub newest first until it reaches a match that has already been parsed,
+        then parses the new matches and adds them to the front of the list.
         """
 
         logging.debug("Partial Called")
-        
-        old_length = len(old_match_id_list)
-        match_id_list = self.get_full_match_list(offset, limit)
-        new_length = len(match_id_list)
-        length_diff = new_length - old_length
-        
-        new_match_id_list = match_id_list[:length_diff]
-        new_match_id_list.reverse() # Reversing to maintain order
-        new_match_data = asyncio.run(match_loop(new_match_id_list))
-        
-        for match_id, data in zip(new_match_id_list, new_match_data):
-            logging.debug(match_id)
-            self.parse_match(match_id, data)
 
-        return match_id_list
+        async def parse():
+            async with faceit_fetcher() as fetcher:
+                return await self.fetch_new(fetcher, offset, limit, old_match_id_list, ProgressReporter(get_current_job()))
+
+        return asyncio.run(parse())
 
 class Match:
 
@@ -223,6 +455,11 @@ class Match:
         self.json = {}
         self.player_stats = {}
         self.player_elo_data = {}
+        self.player_names = {}
+        self.raw_map = None
+        self.match_elo = None
+        self.team_one_elo = None
+        self.team_two_elo = None
 
     def match_parse(self, data : TypeJSON) -> None:
 
@@ -230,7 +467,8 @@ class Match:
         
         self.json["game_mode"] = data["game_mode"]
         self.json["number_of_rounds"] = int(data["round_stats"]["Rounds"])
-        self.json["map"] = data["round_stats"]["Map"].split("/")[-1]
+        self.raw_map = data["round_stats"]["Map"]
+        self.json["map"] = self.raw_map.split("/")[-1]
         self.json["team_one_score"] = data["teams"][0]["team_stats"]["Final Score"]
         self.json["team_two_score"] = data["teams"][1]["team_stats"]["Final Score"]
         self.json["team_one"] = [player["player_id"] for player in data["teams"][0]["players"]]
@@ -262,6 +500,7 @@ class Match:
             player_stats = data["teams"][team - 1]["players"][i]["player_stats"]
 
             self.player_stats[player] = player_stats
+            self.player_names[player] = data["teams"][team - 1]["players"][i]["nickname"]
 
             for stat in self.player_stats[player].keys():
                 self.player_stats[player][stat] = float(self.player_stats[player][stat])
@@ -276,12 +515,17 @@ class Match:
         return team_one_data, team_two_data
 
     @staticmethod
-    def full_parse(match_id : str, match_data : TypeJSON, match_json : TypeJSON, player_json : TypeJSON) -> None:
-        "Parses all stats related to a single match and updates both match_json and player_json"
+    def parse(match_id : str, match_data : TypeJSON):
+        "Parses the stats of a single match without touching player_json, safe to call in any order"
         if match_data is None:
             return None
         current_match = Match(match_id)
         current_match.match_parse(match_data)
+        return current_match
+
+    @staticmethod
+    def apply(current_match, match_json : TypeJSON, player_json : TypeJSON) -> None:
+        "Calculates Elo for a parsed match and updates both match_json and player_json, must be called in match order"
         current_match_elo = Elo(current_match.json["team_one"], current_match.json["team_two"], current_match.player_stats, player_json)
         current_match.match_elo = current_match_elo._match_elo
         current_match.team_one_elo = current_match_elo.team_one_elo
@@ -300,6 +544,16 @@ class Match:
             player_json[player]["elo"] += elo_change
             player_json[player]["elo_history"].append(player_json[player]["elo"])
         current_match.json_update(match_json)
+        if isinstance(player_json, PlayerStatsStore):
+            player_json.index_match(current_match.match_id, match_json[current_match.match_id])
+
+    @staticmethod
+    def full_parse(match_id : str, match_data : TypeJSON, match_json : TypeJSON, player_json : TypeJSON) -> None:
+        "Parses all stats related to a single match and updates both match_json and player_json"
+        current_match = Match.parse(match_id, match_data)
+        if current_match is None:
+            return None
+        Match.apply(current_match, match_json, player_json)
 
     def json_update(self, data : TypeJSON):
         "Adds match stats as entry into data under match_id"
@@ -344,80 +598,17 @@ class Player:
         }
 
     @staticmethod
-    def stat_parse(data : TypeJSON, match_id : str, total_rounds, match_map : str, statistics) -> None:
-            
-        data["stats"]["Match ID"].append(match_id)
-        data["stats"]["Number of Rounds"].append(int(total_rounds))
-        data["stats"]["Map"].append(match_map)
-
-        for statistic in statistics:
-            data["stats"][statistic].append(float(statistics[statistic]))
-
-    @staticmethod
-    def json_init() -> TypeJSON:
-        "Returns an unpopulated Json object for players who are not in the player_json yet"
-        return {
-            "name" : None,
-            "stats" : {
-                "Match ID" : [],
-                "Number of Rounds" : [],
-                "Map" : [],
-                'Deaths': [],
-                'K/R Ratio': [],
-                'MVPs': [],
-                'Headshots': [],
-                'Triple Kills': [],
-                'Result': [],
-                'Assists': [],
-                'Penta Kills': [],
-                'Headshots %': [],
-                'K/D Ratio': [],
-                'Quadro Kills': [],
-                'Kills': []
-            },
-            "elo" : 1000,
-            "elo_history" : []
-        }
-
-    @classmethod
-    def parse_match_data(cls, match_id : str, match_data : TypeJSON, player_dict : TypeJSON) -> None:
-        """
-        Retrieves player stats from match data and adds them to player_dict.
-
-        Parameters
-        ----------
-
-        match_id : str
-                text
-        match_data : dict, JSON
-                text
-        player_dict : dict
-                text
-        insert : bool False
-                text
-
-        Returns
-        -------
-
-        None
-
-        """
-        
-        if match_data == None:
-            
-            return None
-        
-        total_rounds = match_data["round_stats"]["Rounds"]
-        match_map = match_data["round_stats"]["Map"]
-        
-        for team in match_data["teams"]:
-            for player in team["players"]:
-                if player["player_id"] not in player_dict.keys():
-                    player_dict[player["player_id"]] = cls.json_init()
-                player_dict[player["player_id"]]["name"] = player["nickname"]
-                cls.stat_parse(player_dict[player["player_id"]], match_id, total_rounds, match_map, player["player_stats"])
-
-        return None
+    def parse_match(current_match : Match, player_store : PlayerStatsStore) -> None:
+        "Adds each player's stats from an already parsed Match to player_store"
+        for player in current_match.json["players"]:
+            player_store.append_stats(
+                player,
+                current_match.player_names[player],
+                current_match.match_id,
+                current_match.json["number_of_rounds"],
+                current_match.raw_map,
+                current_match.player_stats[player]
+            )
 
     def json_update(self, data : TypeJSON) -> None:
         "Updates the data object with the stats from the latest match"
@@ -0,0 +1,148 @@
+import aiohttp
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Dict
+import ujson
+
+# Defaults can be tuned per deployment to match the quota of the API key in use
+concurrency = int(os.environ.get("FACEIT_CONCURRENCY", 20))
+rate_limit = float(os.environ.get("FACEIT_RATE_LIMIT", 10)) # Requests per second
+rate_burst = int(os.environ.get("FACEIT_RATE_BURST", 20))
+max_retries = int(os.environ.get("FACEIT_MAX_RETRIES", 5))
+request_timeout = float(os.environ.get("FACEIT_TIMEOUT", 30)) # Seconds
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class FetchError(Exception):
+    "Raised when a request still fails after all retries"
+
+class TokenBucket:
+    """
+    Token bucket rate limiter, allows bursts of up to capacity requests and
+    refills at rate tokens per second.
+    """
+
+    def __init__(self, rate : float, capacity : int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def pause(self, seconds : float) -> None:
+        "Stops handing out tokens for the given number of seconds, used when the API asks us to back off"
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+        # Refill from the end of the pause, otherwise the pause itself is credited and a full burst follows it
+        self.updated = self.paused_until
+
+    async def acquire(self) -> None:
+        "Waits until a token is available and takes it"
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return None
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class Fetcher:
+    """
+    Shared HTTP client for the Faceit API. Limits the number of requests in flight and the
+    request rate, and retries rate limited, failed and timed out requests with exponential
+    backoff. Use as an async context manager.
+
+    Parameters
+    ----------
+
+    headers : dict
+            Headers sent with every request.
+    concurrency : int
+            Maximum number of requests in flight at once.
+    rate : float
+            Sustained requests per second.
+    burst : int
+            Number of requests that can be made at once before the rate applies.
+    retries : int
+            Number of times a failed request is retried before FetchError is raised.
+    timeout : float
+            Timeout in seconds for each individual request.
+    """
+
+    backoff_base = 0.5
+    backoff_max = 60
+
+    def __init__(self, headers : Dict[str, str] = None, concurrency : int = concurrency, rate : float = rate_limit,
+                 burst : int = rate_burst, retries : int = max_retries, timeout : float = request_timeout):
+        self.headers = headers
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = retries
+        self.timeout = aiohttp.ClientTimeout(total = timeout)
+        self.session = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(headers = self.headers, json_serialize = ujson.dumps)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    def _backoff(self, attempt : int, retry_after : str = None) -> float:
+        "Seconds to wait before the next attempt, honours a numeric Retry-After header"
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def get_json(self, url : str):
+        """
+        Makes a get request and returns the decoded JSON body, or None if the resource does not exist.
+        Raises FetchError if the request cannot be completed.
+        """
+
+        for attempt in range(self.retries + 1):
+            await self.bucket.acquire()
+            retry_after = None
+            try:
+                async with self.semaphore:
+                    async with self.session.get(url, timeout = self.timeout) as resp:
+                        if resp.status == 200:
+                            return await resp.json(loads = ujson.loads)
+                        if resp.status == 404:
+                            return None
+                        if resp.status not in RETRY_STATUSES:
+                            raise FetchError(f"{url} returned {resp.status}")
+                        retry_after = resp.headers.get("Retry-After")
+                        error = f"status {resp.status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = repr(e)
+
+            if attempt == self.retries:
+                break
+            delay = self._backoff(attempt, retry_after)
+            if retry_after is not None:
+                self.bucket.pause(delay) # Everyone shares the same quota so everyone waits
+            logging.debug(f"Retrying {url} in {delay:.1f}s after {error}")
+            await asyncio.sleep(delay)
+
+        raise FetchError(f"{url} failed after {self.retries + 1} attempts, last error {error}")
+
+if __name__ == "__main__":
+    pass
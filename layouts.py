@@ -3,7 +3,6 @@ import dash_bootstrap_components as dbc
 from faceit import Player
 
 stat_page = html.Div([
-    dcc.Store(id = "stat-data"),
     html.Div([
         dbc.CardBody([
             dbc.Row([
@@ -31,7 +30,8 @@ stat_page = html.Div([
                                 max = 20,
                                 step = 1,
                                 marks={i : f"{i}" for i in range(1, 21)},
-                                value=10
+                                value=10,
+                                tooltip = {"placement" : "bottom"}
                             )
                         ])
                     ])
@@ -70,7 +70,18 @@ match_page = html.Div([
                     dbc.Card([
                         dbc.CardBody([
                             dbc.Row([
-                                dcc.Dropdown(id = "player-filter", multi = False, value = "All")
+                                dcc.Dropdown(id = "player-filter", multi = True, value = [], placeholder = "Played in by all of")
+                            ]),
+                            dbc.Row([
+                                dcc.Dropdown(id = "map-filter", multi = True, value = [], placeholder = "Played on any of")
+                            ]),
+                            dbc.Row([
+                                dcc.Dropdown(
+                                    id = "result-filter",
+                                    options = [{"label" : x, "value" : x} for x in ["Any Result", "Won", "Lost"]],
+                                    value = "Any Result",
+                                    clearable = False
+                                )
                             ]),
                             dbc.Row([
                                 dcc.Dropdown(
@@ -120,6 +131,15 @@ match_balance_page = html.Div([
                     html.Div(id = 'match-create-main', children = [
                         html.Div([
                             dcc.Dropdown(id = 'elo-filter', multi = True),
+                            dbc.InputGroup([
+                                dbc.InputGroupText("Players per team"),
+                                dbc.Input(id = 'team-size', type = "number", min = 1, max = 15, step = 1, value = 5)
+                            ]),
+                            dcc.Dropdown(id = 'team-one-lock', multi = True, placeholder = "Locked to Team 1"),
+                            dcc.Dropdown(id = 'team-two-lock', multi = True, placeholder = "Locked to Team 2"),
+                            dcc.Dropdown(id = 'party', multi = True, placeholder = "Keep together"),
+                            dcc.Dropdown(id = 'split-up', multi = True, placeholder = "Keep apart"),
+                            dbc.Button("More Teams", id = "more-teams", n_clicks = 0, className="me-1")
                         ]),
                         html.Div(id = 'match-create')
                     ])
@@ -199,8 +219,7 @@ data_retrieve_page = html.Div([
             dbc.Card([
                 dbc.CardBody([
                     dbc.Row([
-                        dbc.Button("Download Dashboard Data", id="download-button", className="me-1"),
-                        dcc.Download(id="download-output")
+                        dbc.Button("Download Dashboard Data", id="download-button", className="me-1", external_link=True, disabled=True)
                     ]),
                 ])
             ])
@@ -0,0 +1,117 @@
+from array import array
+from typing import Dict, Iterable, List
+
+# Inverted index over parsed matches for the match explorer. Each match gets an ordinal in the
+# order it was parsed, and every player, map and player win keeps the ordinals of its matches
+# in an array. Queries turn those arrays into bitmaps, Python ints with bit i set for ordinal i,
+# so a compound filter is a handful of & and | operations instead of a scan of every match.
+
+class MatchIndex:
+    "Ordinal arrays per player, map and player win, with bitmaps built from them on demand"
+
+    def __init__(self):
+        self.match_ids = []
+        self.ordinals = {}
+        self.players = {}
+        self.maps = {}
+        self.wins = {}
+        self._bitmaps = {}
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_bitmaps"]
+        return state
+
+    def __setstate__(self, state : dict) -> None:
+        self.__dict__.update(state)
+        self._bitmaps = {}
+
+    def __len__(self) -> int:
+        return len(self.match_ids)
+
+    def __contains__(self, match_id) -> bool:
+        return match_id in self.ordinals
+
+    def add(self, match_id : str, match : dict) -> None:
+        "Adds a parsed match, matches must be added in the order they were parsed"
+        if match_id in self.ordinals:
+            return None
+        ordinal = len(self.match_ids)
+        self.ordinals[match_id] = ordinal
+        self.match_ids.append(match_id)
+        winners = (match["team_one"], match["team_two"])[match["winner"] - 1]
+        for player in match["players"]:
+            self.players.setdefault(player, array("l")).append(ordinal)
+            if player in winners:
+                self.wins.setdefault(player, array("l")).append(ordinal)
+        self.maps.setdefault(match["map"], array("l")).append(ordinal)
+        self._bitmaps.clear()
+
+    def _bitmap(self, kind : str, key : str) -> int:
+        "Bitmap of the matches in one of players, maps or wins, cached until the next add"
+        cache_key = (kind, key)
+        bitmap = self._bitmaps.get(cache_key)
+        if bitmap is None:
+            bits = bytearray((len(self.match_ids) + 7) // 8)
+            for ordinal in getattr(self, kind).get(key, ()):
+                bits[ordinal >> 3] |= 1 << (ordinal & 7)
+            bitmap = self._bitmaps[cache_key] = int.from_bytes(bits, "little")
+        return bitmap
+
+    def bitmap(self, players : Iterable[str] = (), maps : Iterable[str] = (), won_by : Iterable[str] = (),
+               lost_by : Iterable[str] = ()) -> int:
+        """
+        Returns the bitmap of matches passing every filter.
+
+        Parameters
+        ----------
+
+        players : iterable
+                Players that all played in the match.
+        maps : iterable
+                Maps the match may have been played on, any map if empty.
+        won_by : iterable
+                Players that all won the match.
+        lost_by : iterable
+                Players that all lost the match.
+        """
+
+        bitmap = (1 << len(self.match_ids)) - 1
+        for player in players:
+            bitmap &= self._bitmap("players", player)
+        maps = list(maps)
+        if maps:
+            on_map = 0
+            for match_map in maps:
+                on_map |= self._bitmap("maps", match_map)
+            bitmap &= on_map
+        for player in won_by:
+            bitmap &= self._bitmap("wins", player)
+        for player in lost_by:
+            bitmap &= self._bitmap("players", player) & ~self._bitmap("wins", player)
+        return bitmap
+
+    def query(self, **filters) -> List[str]:
+        "Returns the IDs of the matches passing every filter, newest first, see bitmap for the filters"
+        bitmap = self.bitmap(**filters)
+        if not bitmap:
+            return []
+        # Set bits from the highest ordinal down, which is newest first
+        bits = bin(bitmap)[2:]
+        top = len(bits) - 1
+        return [self.match_ids[top - i] for i, bit in enumerate(bits) if bit == "1"]
+
+    def count(self, **filters) -> int:
+        "Returns the number of matches passing every filter"
+        return bin(self.bitmap(**filters)).count("1")
+
+    @classmethod
+    def from_matches(cls, match_json : Dict[str, dict]):
+        "Builds an index from parsed matches in the order they were parsed"
+        index = cls()
+        for match_id, match in match_json.items():
+            index.add(match_id, match)
+        return index
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,107 @@
+from functools import wraps
+import hashlib
+import os
+import pickle
+import time
+from worker import conn
+import zlib
+
+# Least recently used cache in Redis so every gunicorn worker shares the same results.
+#
+# memo:{namespace}:values   hash of key : compressed pickled value
+# memo:{namespace}:lru      sorted set of key : last time it was read or written, the lowest
+#                           scores are evicted once the cache is over max_entries
+
+memo_ttl = int(os.environ.get("MEMO_TTL", 24 * 60 * 60)) # Seconds, an unused cache disappears after this
+
+def _canonical(value):
+    "Converts value to a form with a stable repr, so equal sets and dicts give equal keys"
+    if isinstance(value, (set, frozenset)):
+        return ("set", tuple(sorted([_canonical(item) for item in value], key = repr)))
+    if isinstance(value, dict):
+        return ("dict", tuple(sorted([(_canonical(k), _canonical(v)) for k, v in value.items()], key = repr)))
+    if isinstance(value, (list, tuple)):
+        return tuple([_canonical(item) for item in value])
+    return value
+
+class RedisLRU:
+    """
+    LRU cache shared through Redis.
+
+    Parameters
+    ----------
+
+    namespace : str
+            Name of the cache, caches with different namespaces never share entries.
+    max_entries : int
+            Number of entries kept, the least recently used are evicted beyond this.
+    ttl : int
+            Seconds before the whole cache expires if it is not written to.
+    """
+
+    def __init__(self, namespace : str, max_entries : int, ttl : int = memo_ttl):
+        self.values_key = f"memo:{namespace}:values"
+        self.lru_key = f"memo:{namespace}:lru"
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    @staticmethod
+    def key(*parts) -> str:
+        "Builds a cache key from any mix of hashable values, sets and dicts"
+        return hashlib.sha1(repr(_canonical(parts)).encode()).hexdigest()
+
+    def get(self, key : str):
+        "Returns the cached value, or None if key is not cached"
+        data = conn.hget(self.values_key, key)
+        if data is None:
+            return None
+        conn.zadd(self.lru_key, {key : time.time()})
+        return pickle.loads(zlib.decompress(data))
+
+    def set(self, key : str, value) -> None:
+        "Caches value, which must not be None, and evicts the least recently used entries"
+        pipe = conn.pipeline(transaction = False)
+        pipe.hset(self.values_key, key, zlib.compress(pickle.dumps(value, protocol = pickle.HIGHEST_PROTOCOL)))
+        pipe.zadd(self.lru_key, {key : time.time()})
+        pipe.zcard(self.lru_key)
+        pipe.expire(self.values_key, self.ttl)
+        pipe.expire(self.lru_key, self.ttl)
+        size = pipe.execute()[2]
+
+        if size > self.max_entries:
+            evicted = conn.zpopmin(self.lru_key, size - self.max_entries)
+            if evicted:
+                conn.hdel(self.values_key, *[evicted_key for evicted_key, _ in evicted])
+
+    def get_or_compute(self, key : str, compute):
+        "Returns the cached value for key, calling compute and caching its result on a miss"
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def memoize(self, key = None):
+        """
+        Decorator caching a function's results in this cache.
+
+        Entries are keyed by the function's name and its arguments, or by what key returns when
+        called with the same arguments. Callbacks should include the dataset handle in the key,
+        its version changes whenever the data does, so stale entries are never read and age out.
+        Exceptions such as PreventUpdate are raised as usual and nothing is cached.
+        """
+
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args):
+                parts = args if key is None else key(*args)
+                return self.get_or_compute(self.key(func.__qualname__, *parts), lambda : func(*args))
+            return wrapper
+        return decorator
+
+    def clear(self) -> None:
+        conn.delete(self.values_key, self.lru_key)
+
+if __name__ == "__main__":
+    pass
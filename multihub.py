@@ -0,0 +1,138 @@
+import argparse
+import asyncio
+from dataset import checkout_players, hub_dataset, load_match_list, refresh_dataset, save_dataset, save_merged_view, set_hub_dataset
+from faceit import HubMatches, ParsePool, faceit_fetcher, stream_window
+import logging
+from progress import ProgressReporter
+from rq import get_current_job
+from store import PlayerStatsStore
+from typing import Dict, List, Tuple
+
+# Syncs several hubs in one job. The hubs share one Fetcher, and with it one connection pool and
+# one request rate budget, as well as one parse process pool. Each hub streams matches with an
+# equal share of the stream window and the Fetcher's token bucket serves waiting requests in the
+# order they arrive, so a hub with a long history can't starve the others. Every hub keeps its own
+# dataset, registered under hub:{hub_id}:dataset, and a player view merged across the hubs can be
+# saved as well.
+
+offset = 0
+actual_limit = 50_000
+
+async def _sync(hubs : Dict[str, HubMatches], old_match_lists : Dict[str, List[str]], progress : ProgressReporter) -> list:
+    "Runs every hub's full or incremental sync concurrently, returns each hub's match list or the exception it raised"
+    window = max(stream_window // len(hubs), 1)
+    pool = ParsePool() # Started once the hubs' matches to parse add up to enough to be worth it
+    try:
+        async with faceit_fetcher() as fetcher:
+            async def sync(hub_id):
+                parse_options = {"pool" : pool, "window" : window}
+                if old_match_lists[hub_id] is None:
+                    return await hubs[hub_id].fetch_all(fetcher, offset, actual_limit, progress, **parse_options)
+                return await hubs[hub_id].fetch_new(fetcher, offset, actual_limit, old_match_lists[hub_id], progress, **parse_options)
+
+            return await asyncio.gather(*[sync(hub_id) for hub_id in hubs], return_exceptions = True)
+    finally:
+        pool.shutdown()
+
+def merge_players(stores : Dict[str, PlayerStatsStore]) -> Dict[str, dict]:
+    """
+    Combines players across hubs' player stores.
+
+    Match counts and stat totals are summed over the hubs. Elo is kept per hub, keyed by hub_id,
+    as each hub rates its players separately.
+    """
+
+    view = {}
+    for hub_id, player_store in stores.items():
+        aggregates = player_store.aggregates
+        for player in player_store:
+            entry = view.setdefault(player, {"name" : player_store.names[player], "Matches" : 0, "Wins" : 0, "Losses" : 0, "Elo" : {}, "Totals" : {}})
+            entry["Wins"] += aggregates.wins.get(player, 0)
+            entry["Losses"] += aggregates.losses.get(player, 0)
+            entry["Matches"] = entry["Wins"] + entry["Losses"]
+            entry["Elo"][hub_id] = player_store.elos[player]
+            for stat, total in aggregates.totals.get(player, {}).items():
+                entry["Totals"][stat] = entry["Totals"].get(stat, 0) + total
+    return view
+
+def sync_hubs_func(hub_ids : List[str], merged : bool = False) -> Tuple[str, Dict[str, dict], str]:
+    """
+    Brings each hub's registered dataset up to date, fetching hubs without one from scratch.
+
+    Parameters
+    ----------
+
+    hub_ids : list
+            Faceit hub IDs.
+    merged : bool
+            Also save a player view merged across the hubs.
+
+    Returns
+    -------
+
+    msg : str
+    handles : dict
+            hub_id : dataset handle for every hub that synced.
+    view_id : str
+            ID of the merged player view, None if not requested.
+    """
+
+    hubs = {}
+    old_match_lists = {}
+    handles = {}
+    for hub_id in dict.fromkeys(hub_ids):
+        handle = hub_dataset(hub_id)
+        try:
+            if handle is None:
+                raise KeyError(hub_id)
+            # Matches are only ever added, so each hub starts without its old ones
+            hubs[hub_id] = HubMatches(hub_id, checkout_players(handle), {})
+            old_match_lists[hub_id] = load_match_list(handle)
+            handles[hub_id] = handle
+        except KeyError:
+            # No dataset yet or it expired
+            hubs[hub_id] = HubMatches(hub_id)
+            old_match_lists[hub_id] = None
+
+    results = asyncio.run(_sync(hubs, old_match_lists, ProgressReporter(get_current_job())))
+
+    messages = []
+    for hub_id, result in zip(hubs, results):
+        if isinstance(result, Exception):
+            logging.warning(f"Sync of hub {hub_id} failed: {result!r}")
+            messages.append(f"{hub_id}: failed, {result}")
+            handles.pop(hub_id, None)
+            continue
+        hub = hubs[hub_id]
+        old_match_list = old_match_lists[hub_id]
+        if old_match_list is None:
+            handles[hub_id] = save_dataset(hub.player_json, hub.match_json, result)
+            messages.append(f"{hub_id}: found {len(result)} matches")
+        else:
+            new_match_list = result[:len(result) - len(old_match_list)]
+            if new_match_list:
+                handles[hub_id] = save_dataset(hub.player_json, hub.match_json, result, new_match_ids = new_match_list, parent = handles[hub_id])
+            else:
+                # Nothing new, but the dataset still has its TTL restarted so it outlives DATASET_TTL while synced
+                handles[hub_id] = refresh_dataset(handles[hub_id]) or handles[hub_id]
+            messages.append(f"{hub_id}: found {len(new_match_list)} new matches")
+        set_hub_dataset(hub_id, handles[hub_id])
+
+    view_id = None
+    if merged and handles:
+        view_id = save_merged_view(merge_players({hub_id : hubs[hub_id].player_json for hub_id in handles}))
+
+    return ", ".join(messages), handles, view_id
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Sync several Faceit hubs into their datasets")
+    parser.add_argument("hub_ids", nargs = "+")
+    parser.add_argument("--merged", action = "store_true", help = "Also save a player view merged across the hubs")
+    args = parser.parse_args()
+
+    msg, handles, view_id = sync_hubs_func(args.hub_ids, args.merged)
+    print(msg)
+    for hub_id, handle in handles.items():
+        print(hub_id, handle)
+    if view_id is not None:
+        print("Merged view", view_id)
@@ -0,0 +1,80 @@
+import os
+import time
+
+# Job meta is saved to Redis on every flush, so updates are buffered and only written
+# once flush_interval seconds or flush_every updates have passed.
+
+flush_interval = float(os.environ.get("PROGRESS_FLUSH_INTERVAL", 0.25)) # Seconds
+flush_every = int(os.environ.get("PROGRESS_FLUSH_EVERY", 500))
+
+class ProgressReporter:
+    """
+    Buffers progress updates for an RQ job and writes them to job.meta in batches.
+
+    job.meta["progress"] and job.meta["length"] keep their meaning, job.meta["rate"] holds the
+    throughput in items per second and job.meta["eta"] the estimated seconds remaining.
+    A reporter with no job does nothing, so code can report progress outside the queue.
+    """
+
+    def __init__(self, job, interval : float = flush_interval, every : int = flush_every):
+        self.job = job
+        self.interval = interval
+        self.every = every
+        self.pending = 0
+        self.started = time.monotonic()
+        self.flushed = self.started
+        self.count = 0
+        if job is not None:
+            self.count = job.meta.get("progress", 0)
+            if not isinstance(self.count, int):
+                self.count = 0
+            job.meta["progress"] = self.count
+        self.start_count = self.count
+
+    def set_length(self, length : int) -> None:
+        "Sets the total number of items and flushes straight away so the total shows up immediately"
+        self.update(length = length)
+        self.flush()
+
+    def add_length(self, n : int) -> None:
+        "Adds n items to the total, for jobs that find more work as they go"
+        length = self.job.meta.get("length") if self.job is not None else None
+        self.set_length((length if isinstance(length, int) else 0) + n)
+
+    def update(self, **meta) -> None:
+        "Sets arbitrary meta values, written on the next flush"
+        if self.job is not None:
+            self.job.meta.update(meta)
+        self._maybe_flush()
+
+    def advance(self, n : int = 1) -> None:
+        "Records n more items as done"
+        self.count += n
+        if self.job is not None:
+            self.job.meta["progress"] = self.count
+        self._maybe_flush(n)
+
+    def _maybe_flush(self, n : int = 1) -> None:
+        self.pending += n
+        if self.pending >= self.every or time.monotonic() - self.flushed >= self.interval:
+            self.flush()
+
+    def flush(self) -> None:
+        "Writes buffered updates to Redis"
+        self.pending = 0
+        self.flushed = time.monotonic()
+        if self.job is None:
+            return None
+
+        elapsed = self.flushed - self.started
+        done = self.count - self.start_count
+        if elapsed > 0 and done > 0:
+            rate = done / elapsed
+            self.job.meta["rate"] = round(rate, 1)
+            length = self.job.meta.get("length")
+            if isinstance(length, int):
+                self.job.meta["eta"] = round(max(length - self.count, 0) / rate, 1)
+        self.job.save_meta()
+
+if __name__ == "__main__":
+    pass
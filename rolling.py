@@ -0,0 +1,97 @@
+from array import array
+from itertools import accumulate
+from typing import Dict, Iterable, Tuple
+
+# Per player prefix sums of every numeric stat, so the sum, mean or per round value of a stat over
+# a player's last n matches is two lookups and a subtraction for any n. Stats a match didn't report
+# are stored as NaN, they count as 0 in the sums and are left out of the counts used for means.
+
+COUNTING_STATS = ["Kills", "Deaths", "Assists", "MVPs", "Headshots", "Triple Kills", "Quadro Kills", "Penta Kills"]
+
+def _prefix(values : Iterable[float]) -> Tuple[array, array]:
+    "Returns the prefix sums of values, NaN as 0, and the prefix counts of the values that aren't NaN"
+    values = list(values)
+    sums = array("d", accumulate((0.0 if value != value else value for value in values), initial = 0.0))
+    counts = array("l", accumulate((value == value for value in values), initial = 0))
+    return sums, counts
+
+class RollingStats:
+    """
+    Prefix sums over each player's stats in match order.
+
+    sums[player_id][stat][i] is the total of stat over the player's first i matches and
+    counts[player_id][stat][i] the number of those matches that reported it.
+    """
+
+    def __init__(self):
+        self.sums = {}
+        self.counts = {}
+
+    def append(self, player_id : str, values : Dict[str, float]) -> None:
+        "Adds the stats from a player's next match"
+        if player_id not in self.sums:
+            self.sums[player_id] = {stat : array("d", [0.0]) for stat in values}
+            self.counts[player_id] = {stat : array("l", [0]) for stat in values}
+        sums = self.sums[player_id]
+        counts = self.counts[player_id]
+        for stat, value in values.items():
+            missing = value != value
+            sums[stat].append(sums[stat][-1] + (0.0 if missing else value))
+            counts[stat].append(counts[stat][-1] + (not missing))
+
+    @classmethod
+    def from_store(cls, store):
+        "Builds prefix sums for every player and numeric stat in a PlayerStatsStore"
+        rolling = cls()
+        for player_id in store.player_rows:
+            rolling.sums[player_id] = {}
+            rolling.counts[player_id] = {}
+            for stat in store.columns:
+                sums, counts = _prefix(store.column(player_id, stat))
+                rolling.sums[player_id][stat] = sums
+                rolling.counts[player_id][stat] = counts
+        return rolling
+
+    def matches(self, player_id : str) -> int:
+        "Number of matches player_id has stats for"
+        sums = self.sums.get(player_id)
+        if not sums:
+            return 0
+        return len(next(iter(sums.values()))) - 1
+
+    def _window(self, player_id : str, n : int) -> Tuple[int, int]:
+        end = self.matches(player_id)
+        return (0 if n is None else max(end - n, 0)), end
+
+    def sum(self, player_id : str, stat : str, n : int = None) -> float:
+        "Total of stat over player_id's last n matches, every match if n is None"
+        start, end = self._window(player_id, n)
+        if end == 0:
+            return 0.0
+        sums = self.sums[player_id][stat]
+        return sums[end] - sums[start]
+
+    def count(self, player_id : str, stat : str, n : int = None) -> int:
+        "Number of player_id's last n matches that reported stat"
+        start, end = self._window(player_id, n)
+        if end == 0:
+            return 0
+        counts = self.counts[player_id][stat]
+        return counts[end] - counts[start]
+
+    def mean(self, player_id : str, stat : str, n : int = None) -> float:
+        "Mean of stat over player_id's last n matches, None if none of them reported it"
+        count = self.count(player_id, stat, n)
+        if not count:
+            return None
+        return self.sum(player_id, stat, n) / count
+
+    def per_round(self, player_id : str, stat : str, n : int = None) -> float:
+        "Total of stat over player_id's last n matches divided by the rounds played in them, None if no rounds"
+        rounds = self.sum(player_id, "Number of Rounds", n)
+        if not rounds:
+            return None
+        return self.sum(player_id, stat, n) / rounds
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,84 @@
+import argparse
+from dataset import registered_hubs, unregister_hub
+import logging
+from multihub import sync_hubs_func
+import os
+import random
+from rq import Queue
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+import time
+from typing import List
+from worker import conn
+
+# Runs alongside worker.py and keeps every registered hub's dataset warm. Every sync_interval
+# seconds, give or take sync_jitter of it, one incremental sync job for all the hubs is put on the
+# low queue, so the first viewer of the day attaches to an up to date dataset instead of waiting on
+# a cold fetch. A tick is skipped while the previous sync is still queued or running, and a lock
+# stops two scheduler processes enqueueing in the same interval.
+#
+# Hubs are registered whenever they are fetched from the dashboard and dropped once HUB_IDLE_TTL
+# passes without another fetch, SCHEDULED_HUBS adds more as a comma separated list. Every sync
+# restarts the TTL of the hubs' datasets, so a scheduled hub never falls back to a cold fetch.
+# python scheduler.py --unregister HUB_ID stops syncing a hub straight away.
+
+sync_interval = float(os.environ.get("SYNC_INTERVAL", 15 * 60)) # Seconds
+sync_jitter = float(os.environ.get("SYNC_JITTER", 0.1)) # Fraction of sync_interval
+sync_timeout = int(os.environ.get("SYNC_TIMEOUT", 60 * 60)) # Seconds, a first sync fetches whole hubs
+configured_hubs = [hub_id.strip() for hub_id in os.environ.get("SCHEDULED_HUBS", "").split(",") if hub_id.strip()]
+
+sync_job_id = "scheduled-sync"
+lock_key = "scheduler:lock"
+ACTIVE_STATUSES = {"queued", "started", "deferred", "scheduled"}
+
+def scheduled_hubs() -> List[str]:
+    return sorted(set(configured_hubs) | set(registered_hubs()))
+
+def next_delay() -> float:
+    "Seconds until the next tick, jittered so scheduler restarts don't line up with other periodic work"
+    return sync_interval * random.uniform(1 - sync_jitter, 1 + sync_jitter)
+
+def sync_running() -> bool:
+    "True if the previous scheduled sync is still queued or running"
+    try:
+        job = Job.fetch(sync_job_id, connection = conn)
+    except NoSuchJobError:
+        return False
+    return job.get_status() in ACTIVE_STATUSES
+
+def tick(queue : Queue) -> Job:
+    "Enqueues a sync of every scheduled hub, returns the job or None if this tick was skipped"
+    hubs = scheduled_hubs()
+    if not hubs:
+        return None
+    # Held for half an interval so only one scheduler process enqueues per interval
+    if not conn.set(lock_key, os.getpid(), nx = True, ex = max(int(sync_interval / 2), 1)):
+        logging.debug("Another scheduler enqueued this interval")
+        return None
+    if sync_running():
+        logging.info("Previous sync still running, skipping")
+        return None
+    logging.info(f"Enqueueing sync of {len(hubs)} hubs")
+    return queue.enqueue(sync_hubs_func, hubs, job_id = sync_job_id, job_timeout = sync_timeout)
+
+def run() -> None:
+    queue = Queue("low", connection = conn)
+    time.sleep(random.uniform(0, sync_interval * sync_jitter))
+    while True:
+        try:
+            tick(queue)
+        except Exception:
+            logging.exception("Scheduling sync failed")
+        time.sleep(next_delay())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Keep registered hubs' datasets up to date")
+    parser.add_argument("--unregister", nargs = "+", metavar = "HUB_ID", help = "Stop syncing these hubs and exit")
+    args = parser.parse_args()
+
+    if args.unregister:
+        for hub_id in args.unregister:
+            unregister_hub(hub_id)
+    else:
+        logging.basicConfig(level = logging.INFO)
+        run()
@@ -0,0 +1,304 @@
+from array import array
+import struct
+import sys
+from store import NUMERIC_STATS, PlayerStatsStore
+from typing import Dict, Iterable, Iterator, List, Tuple
+import ujson
+import zlib
+
+# Binary dataset snapshots, used by Download Dashboard Data and Data Upload.
+#
+# A snapshot is MAGIC, a format version byte, then sections. Each section is a name and a zlib
+# compressed payload, both length prefixed. Player stats are written column by column straight from
+# the PlayerStatsStore arrays, integers as little endian int64 and floats as little endian float64,
+# so loading is a handful of frombytes calls rather than parsing a number at a time. Matches are
+# nested dicts with no fixed shape, so they are written last as one compact JSON [match_id, match]
+# record per line, which lets a reader take them one at a time without holding the whole file.
+# Format 1 wrote the matches section as a single JSON object and is still readable.
+#
+# Files that don't start with MAGIC are read as the old dashboard_data.json format.
+
+MAGIC = b"FHSNAP"
+FORMAT_VERSION = 2
+compression_level = 6
+read_size = 64 * 1024 # Compressed bytes decompressed at a time when streaming
+
+REQUIRED_MATCH_KEYS = ("team_one", "team_two", "winner", "player_stats", "player_elo_data")
+
+_header = struct.Struct("<6sB")
+_section = struct.Struct("<HQ")
+
+def _int_bytes(values) -> bytes:
+    values = array("q", values)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+def _float_bytes(values) -> bytes:
+    values = array("d", values)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+def _from_bytes(typecode : str, data : bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+def dump_snapshot(player_store : PlayerStatsStore, match_json : dict, match_list : List[str]) -> bytes:
+    """
+    Serialises a dataset to the binary snapshot format.
+
+    Parameters
+    ----------
+
+    player_store : PlayerStatsStore
+            Player stats and Elo.
+    match_json : dict
+            Parsed matches keyed by match_id.
+    match_list : list
+            Match IDs, newest first.
+
+    Returns
+    -------
+
+    snapshot : bytes
+    """
+
+    players = list(player_store.player_rows)
+    meta = {
+        "players" : players,
+        "names" : [player_store.names[player] for player in players],
+        "elos" : [player_store.elos[player] for player in players],
+        "row_counts" : [len(player_store.player_rows[player]) for player in players],
+        "history_counts" : [len(player_store.elo_histories[player]) for player in players],
+        "match_ids" : player_store.match_ids,
+        "maps" : player_store.maps,
+        "stats" : NUMERIC_STATS,
+        "match_list" : match_list
+    }
+
+    sections = [
+        ("meta", ujson.dumps(meta).encode()),
+        ("rows", _int_bytes([row for player in players for row in player_store.player_rows[player]])),
+        ("elo_history", _float_bytes([elo for player in players for elo in player_store.elo_histories[player]])),
+        ("match_codes", _int_bytes(player_store.match_codes)),
+        ("map_codes", _int_bytes(player_store.map_codes))
+    ]
+    for stat in NUMERIC_STATS:
+        values = player_store.columns[stat]
+        sections.append((f"stat:{stat}", _float_bytes(values) if values.typecode == "d" else _int_bytes(values)))
+    sections.append(("matches", b"".join([ujson.dumps([match_id, match]).encode() + b"\n" for match_id, match in match_json.items()])))
+
+    parts = [_header.pack(MAGIC, FORMAT_VERSION)]
+    for name, payload in sections:
+        name = name.encode()
+        payload = zlib.compress(payload, compression_level)
+        parts.append(_section.pack(len(name), len(payload)))
+        parts.append(name)
+        parts.append(payload)
+    return b"".join(parts)
+
+class _ChunkReader:
+    "Reads exact numbers of bytes from an iterable of byte chunks"
+
+    def __init__(self, chunks : Iterable[bytes]):
+        self.chunks = iter(chunks)
+        self.buffer = b""
+        self.position = 0
+
+    def _fill(self, n : int) -> None:
+        while len(self.buffer) - self.position < n:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return None
+            self.buffer = self.buffer[self.position:] + chunk
+            self.position = 0
+
+    def read(self, n : int, partial : bool = False) -> memoryview:
+        "Returns the next n bytes, or between 1 and n bytes if partial. Returns nothing once the input has run out"
+        self._fill(1 if partial else n)
+        available = len(self.buffer) - self.position
+        if not partial and 0 < available < n:
+            raise ValueError("Snapshot is truncated")
+        data = memoryview(self.buffer)[self.position:self.position + min(n, available)]
+        self.position += len(data)
+        return data
+
+def _validate_match(record, number : int) -> Tuple[str, dict]:
+    if not (isinstance(record, list) and len(record) == 2 and isinstance(record[0], str) and isinstance(record[1], dict)):
+        raise ValueError(f"Match record {number} is not a [match_id, match] pair")
+    missing = [key for key in REQUIRED_MATCH_KEYS if key not in record[1]]
+    if missing:
+        raise ValueError(f"Match {record[0]} is missing {', '.join(missing)}")
+    return record[0], record[1]
+
+def _decompress(name : str, payload : bytes) -> bytes:
+    try:
+        return zlib.decompress(payload)
+    except zlib.error as e:
+        raise ValueError(f"Snapshot section {name} is corrupt") from e
+
+def _match_records(reader : _ChunkReader, length : int, version : int) -> Iterator[Tuple[str, dict]]:
+    "Decompresses the matches section a piece at a time and yields each match"
+    decompressor = zlib.decompressobj()
+    pending = b""
+    number = 0
+    remaining = length
+    while remaining or pending:
+        if remaining:
+            piece = reader.read(min(remaining, read_size), partial = True)
+            if not piece:
+                raise ValueError("Snapshot is truncated")
+            remaining -= len(piece)
+            try:
+                pending += decompressor.decompress(piece)
+                if not remaining:
+                    pending += decompressor.flush()
+            except zlib.error as e:
+                raise ValueError("Snapshot section matches is corrupt") from e
+            if not remaining and not decompressor.eof:
+                raise ValueError("Snapshot section matches is truncated")
+        if version == 1:
+            # The whole section is one JSON object
+            if not remaining:
+                for match_id, match in ujson.loads(pending).items():
+                    number += 1
+                    yield _validate_match([match_id, match], number)
+                pending = b""
+            continue
+        lines = pending.split(b"\n")
+        pending = lines.pop() if remaining else b""
+        for line in lines:
+            if line:
+                number += 1
+                yield _validate_match(ujson.loads(line), number)
+
+def _build_store(meta : dict, sections : Dict[str, bytes]) -> PlayerStatsStore:
+    "Rebuilds a PlayerStatsStore from the meta and array sections, checking they fit together"
+    rows = _from_bytes("q", sections["rows"])
+    elo_history = _from_bytes("d", sections["elo_history"])
+    match_codes = _from_bytes("q", sections["match_codes"])
+    if sum(meta["row_counts"]) != len(rows) or sum(meta["history_counts"]) != len(elo_history):
+        raise ValueError("Snapshot player rows don't match the player list")
+    if any(len(sections[f"stat:{stat}"]) != len(match_codes) * 8 for stat in meta["stats"]):
+        raise ValueError("Snapshot stat columns have different lengths")
+
+    player_rows = {}
+    elo_histories = {}
+    row_start = history_start = 0
+    for player, row_count, history_count in zip(meta["players"], meta["row_counts"], meta["history_counts"]):
+        player_rows[player] = array("l", rows[row_start:row_start + row_count])
+        elo_histories[player] = elo_history[history_start:history_start + history_count]
+        row_start += row_count
+        history_start += history_count
+
+    columns = {}
+    for stat in meta["stats"]:
+        if stat == "Number of Rounds":
+            columns[stat] = array("l", _from_bytes("q", sections[f"stat:{stat}"]))
+        else:
+            columns[stat] = _from_bytes("d", sections[f"stat:{stat}"])
+
+    player_store = PlayerStatsStore()
+    player_store.__setstate__({
+        "columns" : columns,
+        "match_codes" : array("l", match_codes),
+        "match_ids" : meta["match_ids"],
+        "map_codes" : array("l", _from_bytes("q", sections["map_codes"])),
+        "maps" : meta["maps"],
+        "player_rows" : player_rows,
+        "names" : dict(zip(meta["players"], meta["names"])),
+        "elos" : dict(zip(meta["players"], meta["elos"])),
+        "elo_histories" : elo_histories
+    })
+    return player_store
+
+def iter_snapshot(chunks : Iterable[bytes]) -> Iterator[Tuple[str, object]]:
+    """
+    Reads a binary snapshot from an iterable of byte chunks without holding the whole file.
+
+    Yields
+    ------
+
+    event : tuple
+            ("match", (match_id, match)) for each match as it is read, then finally
+            ("dataset", (player_store, match_list)).
+
+    Raises
+    ------
+
+    ValueError
+            If the snapshot is truncated, corrupt, from a newer version or holds invalid records.
+    """
+
+    reader = _ChunkReader(chunks)
+    header = reader.read(_header.size)
+    if len(header) < _header.size or bytes(header[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a dashboard snapshot")
+    _, version = _header.unpack(header)
+    if version > FORMAT_VERSION:
+        raise ValueError(f"Snapshot format {version} is newer than this version of the dashboard supports")
+
+    sections = {}
+    # Aggregates and the match index are built as the matches stream past, then moved onto the real store
+    layers = PlayerStatsStore()
+    while True:
+        section_header = reader.read(_section.size)
+        if not section_header:
+            break
+        name_length, payload_length = _section.unpack(section_header)
+        name = bytes(reader.read(name_length)).decode()
+        if name == "matches":
+            for record in _match_records(reader, payload_length, version):
+                layers.index_match(*record)
+                yield "match", record
+        else:
+            sections[name] = _decompress(name, reader.read(payload_length))
+
+    meta = ujson.loads(sections["meta"])
+    player_store = _build_store(meta, sections)
+    player_store.aggregates = layers.aggregates
+    player_store.match_index = layers.match_index
+    yield "dataset", (player_store, meta["match_list"])
+
+def _load_binary(data : bytes) -> Tuple[PlayerStatsStore, dict, List[str]]:
+    match_json = {}
+    for kind, value in iter_snapshot([data]):
+        if kind == "match":
+            match_json[value[0]] = value[1]
+        else:
+            player_store, match_list = value
+    return player_store, match_json, match_list
+
+def _load_legacy(data : bytes) -> Tuple[PlayerStatsStore, dict, List[str]]:
+    "Reads the old dashboard_data.json format"
+    data = ujson.loads(data)
+    for number, (match_id, match) in enumerate(data["match_dict"].items()):
+        _validate_match([match_id, match], number + 1)
+    return PlayerStatsStore.from_json(data["player_dict"], data["match_dict"]), data["match_dict"], data["match_list"]
+
+def is_snapshot(data : bytes) -> bool:
+    return data[:len(MAGIC)] == MAGIC
+
+def load_snapshot(data : bytes) -> Tuple[PlayerStatsStore, dict, List[str]]:
+    """
+    Reads a dataset from a binary snapshot or an old JSON export.
+
+    Returns
+    -------
+
+    player_store : PlayerStatsStore
+    match_json : dict
+    match_list : list
+            Match IDs, newest first.
+    """
+
+    if is_snapshot(data):
+        return _load_binary(data)
+    return _load_legacy(data)
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,257 @@
+from aggregates import Aggregates
+from array import array
+from match_index import MatchIndex
+from collections.abc import Mapping, MutableMapping
+from rolling import RollingStats
+from typing import Dict, Iterable, Iterator, List, Union
+
+# Columnar storage for player stats. Every (player, match) pair is one row, each stat is a
+# single typed array covering all rows and each player keeps the indexes of their rows.
+# After compact() a player's rows are contiguous, so per player columns are memoryview
+# slices rather than copies.
+
+STAT_ORDER = [
+    "Match ID",
+    "Number of Rounds",
+    "Map",
+    'Deaths',
+    'K/R Ratio',
+    'MVPs',
+    'Headshots',
+    'Triple Kills',
+    'Result',
+    'Assists',
+    'Penta Kills',
+    'Headshots %',
+    'K/D Ratio',
+    'Quadro Kills',
+    'Kills'
+]
+
+NUMERIC_STATS = [stat for stat in STAT_ORDER if stat not in ("Match ID", "Map")]
+
+Column = Union[memoryview, array, List[str]]
+
+def _typecode(stat : str) -> str:
+    return "l" if stat == "Number of Rounds" else "d"
+
+class PlayerStatsStore(Mapping):
+    """
+    Array backed replacement for the player_json dict of lists.
+
+    Indexing by player_id returns a PlayerView that behaves like the old player_json entry, so
+    store[player_id]["elo"] += change and store[player_id]["elo_history"].append(elo) keep working.
+    to_json and from_json convert to and from the old format.
+    """
+
+    def __init__(self):
+        self.columns = {stat : array(_typecode(stat)) for stat in NUMERIC_STATS}
+        self.match_codes = array("l")
+        self.match_ids = []
+        self.match_lookup = {}
+        self.map_codes = array("l")
+        self.maps = []
+        self.map_lookup = {}
+        self.player_rows = {}
+        self.names = {}
+        self.elos = {}
+        self.elo_histories = {}
+        self.aggregates = Aggregates()
+        self.match_index = MatchIndex()
+        self.rolling = RollingStats()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["match_lookup"], state["map_lookup"], state["rolling"]
+        return state
+
+    def __setstate__(self, state : dict) -> None:
+        # Stores pickled before these existed, the loader rebuilds them with reindex
+        self.aggregates = None
+        self.match_index = None
+        self.__dict__.update(state)
+        self.match_lookup = {match_id : code for code, match_id in enumerate(self.match_ids)}
+        self.map_lookup = {match_map : code for code, match_map in enumerate(self.maps)}
+        # Prefix sums are derived from the columns, so they are rebuilt rather than pickled
+        self.rolling = RollingStats.from_store(self)
+
+    def __getitem__(self, player_id : str):
+        if player_id not in self.player_rows:
+            raise KeyError(player_id)
+        return PlayerView(self, player_id)
+
+    def __setitem__(self, player_id : str, data : dict) -> None:
+        "Adds a new player from an entry in the old player_json format"
+        if player_id in self.player_rows:
+            raise KeyError(f"{player_id} is already in the store")
+        self.add_player(player_id, data["name"], data["elo"])
+        stats = data["stats"]
+        for i in range(len(stats["Match ID"])):
+            statistics = {stat : stats[stat][i] for stat in NUMERIC_STATS if stat != "Number of Rounds"}
+            self.append_stats(player_id, data["name"], stats["Match ID"][i], stats["Number of Rounds"][i], stats["Map"][i], statistics)
+        self.elo_histories[player_id].extend(data["elo_history"])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.player_rows)
+
+    def __len__(self) -> int:
+        return len(self.player_rows)
+
+    def __contains__(self, player_id) -> bool:
+        return player_id in self.player_rows
+
+    @property
+    def num_rows(self) -> int:
+        return len(self.match_codes)
+
+    @staticmethod
+    def _code(value : str, values : List[str], lookup : Dict[str, int]) -> int:
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(values)
+            values.append(value)
+        return code
+
+    def add_player(self, player_id : str, name : str = None, elo : float = 1000) -> None:
+        "Adds a player with no matches"
+        self.player_rows[player_id] = array("l")
+        self.names[player_id] = name
+        self.elos[player_id] = elo
+        self.elo_histories[player_id] = array("d")
+
+    def append_stats(self, player_id : str, name : str, match_id : str, total_rounds, match_map : str, statistics : dict) -> None:
+        "Adds a row for player_id's stats in one match, stats missing from statistics are stored as NaN"
+        if player_id not in self.player_rows:
+            self.add_player(player_id)
+        self.names[player_id] = name
+        self.player_rows[player_id].append(self.num_rows)
+        self.match_codes.append(self._code(match_id, self.match_ids, self.match_lookup))
+        self.map_codes.append(self._code(match_map, self.maps, self.map_lookup))
+        self.columns["Number of Rounds"].append(int(total_rounds))
+        for stat in NUMERIC_STATS:
+            if stat != "Number of Rounds":
+                self.columns[stat].append(float(statistics.get(stat, "nan")))
+        self.rolling.append(player_id, {stat : self.columns[stat][-1] for stat in NUMERIC_STATS})
+
+    def set_elo(self, player_id : str, elo : float, elo_history : Iterable[float]) -> None:
+        "Replaces a player's current Elo and Elo history, used when Elo is recomputed from scratch"
+        self.elos[player_id] = elo
+        self.elo_histories[player_id] = array("d", elo_history)
+
+    def index_match(self, match_id : str, match : dict) -> None:
+        "Adds a match to the aggregates and the match index once its Elo data has been calculated, call in match order"
+        self.aggregates.add_match(match)
+        self.match_index.add(match_id, match)
+
+    def reindex(self, match_json : dict) -> None:
+        "Rebuilds the aggregates and the match index from parsed matches, oldest first"
+        self.aggregates = Aggregates.from_matches(match_json.values())
+        self.match_index = MatchIndex.from_matches(match_json)
+
+    def column(self, player_id : str, stat : str) -> Column:
+        "Returns player_id's values of stat in match order, a zero copy view if the player's rows are contiguous"
+        rows = self.player_rows[player_id]
+        if stat == "Match ID":
+            return [self.match_ids[self.match_codes[row]] for row in rows]
+        if stat == "Map":
+            return [self.maps[self.map_codes[row]] for row in rows]
+        values = self.columns[stat]
+        if not rows:
+            return array(values.typecode)
+        if rows[-1] - rows[0] + 1 == len(rows):
+            return memoryview(values)[rows[0]:rows[-1] + 1]
+        return array(values.typecode, (values[row] for row in rows))
+
+    def compact(self) -> None:
+        "Reorders rows so each player's rows are contiguous"
+        order = array("l")
+        for player_id, rows in self.player_rows.items():
+            start = len(order)
+            order.extend(rows)
+            self.player_rows[player_id] = array("l", range(start, len(order)))
+        self.match_codes = array("l", (self.match_codes[row] for row in order))
+        self.map_codes = array("l", (self.map_codes[row] for row in order))
+        for stat, values in self.columns.items():
+            self.columns[stat] = array(values.typecode, (values[row] for row in order))
+
+    def player_json(self, player_id : str) -> dict:
+        "Returns a single player in the old player_json format"
+        return {
+            "name" : self.names[player_id],
+            "stats" : {stat : list(self.column(player_id, stat)) for stat in STAT_ORDER},
+            "elo" : self.elos[player_id],
+            "elo_history" : self.elo_histories[player_id].tolist()
+        }
+
+    def to_json(self) -> dict:
+        "Returns the whole store in the old player_json format"
+        return {player_id : self.player_json(player_id) for player_id in self.player_rows}
+
+    @classmethod
+    def from_json(cls, player_json : dict, match_json : dict = None):
+        "Builds a store from data in the old player_json format, aggregates and the match index are built from match_json if given"
+        store = cls()
+        for player_id, data in player_json.items():
+            store[player_id] = data
+        store.compact()
+        if match_json is not None:
+            store.reindex(match_json)
+        return store
+
+class PlayerView(MutableMapping):
+    "Dict like view of a single player in a PlayerStatsStore"
+
+    fields = ("name", "stats", "elo", "elo_history")
+
+    def __init__(self, store : PlayerStatsStore, player_id : str):
+        self.store = store
+        self.player_id = player_id
+
+    def __getitem__(self, key : str):
+        if key == "name":
+            return self.store.names[self.player_id]
+        if key == "elo":
+            return self.store.elos[self.player_id]
+        if key == "elo_history":
+            return self.store.elo_histories[self.player_id]
+        if key == "stats":
+            return StatsView(self.store, self.player_id)
+        raise KeyError(key)
+
+    def __setitem__(self, key : str, value) -> None:
+        if key == "name":
+            self.store.names[self.player_id] = value
+        elif key == "elo":
+            self.store.elos[self.player_id] = value
+        else:
+            raise KeyError(f"{key} is read only")
+
+    def __delitem__(self, key : str) -> None:
+        raise KeyError(f"{key} is read only")
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.fields)
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+class StatsView(Mapping):
+    "Dict like view of a single player's stat columns"
+
+    def __init__(self, store : PlayerStatsStore, player_id : str):
+        self.store = store
+        self.player_id = player_id
+
+    def __getitem__(self, stat : str) -> Column:
+        if stat not in STAT_ORDER:
+            raise KeyError(stat)
+        return self.store.column(self.player_id, stat)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(STAT_ORDER)
+
+    def __len__(self) -> int:
+        return len(STAT_ORDER)
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,168 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from elo import EloParameters, match_columns, replay_elo
+from itertools import product
+import numpy as np
+import os
+import pandas as pd
+from typing import Dict, List
+
+# Replays a cached match history under a grid of Elo parameters to compare them without
+# refetching or reparsing anything. Each parameter set is replayed in its own process.
+
+sweep_processes = int(os.environ.get("SWEEP_PROCESSES", os.cpu_count() or 1))
+convergence_tolerance = 50 # Elo within which a player counts as settled on their final rating
+convergence_min_matches = 20 # Players with fewer matches are left out of the convergence metric
+
+# Set once per pool process by _init_worker so the history is only pickled once per process
+_columns = None
+_num_players = None
+
+def parameter_grid(grid : Dict[str, List]) -> List[dict]:
+    """
+    Returns every combination of the values in grid.
+
+    Parameters
+    ----------
+
+    grid : dict
+            Parameter name : list of values to try, see EloParameters for the names.
+
+    Returns
+    -------
+
+    parameter_sets : list
+            One dict of parameter name : value per combination.
+    """
+
+    names = list(grid)
+    return [dict(zip(names, values)) for values in product(*[grid[name] for name in names])]
+
+def evaluate(columns : Dict[str, np.ndarray], num_players : int, overrides : dict) -> dict:
+    """
+    Replays the history with one parameter set and returns summary metrics.
+
+    Returns
+    -------
+
+    metrics : dict
+            The parameters plus
+            "prediction_accuracy" share of matches, with unequal team Elo, won by the higher Elo team,
+            "rating_spread" standard deviation of the final ratings,
+            "matches_to_converge" median number of matches a player needs before their rating stays
+            within convergence_tolerance of their final rating,
+            "mean_abs_change" mean absolute Elo change per player per match.
+    """
+
+    parameters = EloParameters(**overrides)
+    timeline = replay_elo(columns, num_players, parameters = parameters)
+    mask = columns["roster"] >= 0
+
+    team_elo = timeline["team_elo"]
+    decided = team_elo[:, 0] != team_elo[:, 1]
+    favourite = np.where(team_elo[:, 0] > team_elo[:, 1], 1, 2)
+    correct = (favourite == columns["winner"])[decided]
+
+    return {
+        **parameters.to_dict(),
+        "prediction_accuracy" : float(correct.mean()) if len(correct) else float("nan"),
+        "rating_spread" : float(timeline["final_elo"].std()),
+        "matches_to_converge" : _matches_to_converge(columns["roster"], timeline),
+        "mean_abs_change" : float(np.abs(timeline["elo_change"][mask]).mean()) if mask.any() else float("nan")
+    }
+
+def _matches_to_converge(roster : np.ndarray, timeline : Dict[str, np.ndarray]) -> float:
+    "Median over players of the number of matches played before their Elo stays near its final value"
+    mask = roster >= 0
+    players = roster[mask]
+    elo_after = (timeline["elo"] + timeline["elo_change"])[mask]
+    # Slots are in match order, a stable sort by player gives each player's history in order
+    order = np.argsort(players, kind = "stable")
+    players = players[order]
+    elo_after = elo_after[order]
+    starts = np.flatnonzero(np.r_[True, players[1:] != players[:-1]])
+    ends = np.r_[starts[1:], len(players)]
+
+    settled = []
+    for start, end in zip(starts, ends):
+        if end - start < convergence_min_matches:
+            continue
+        history = elo_after[start:end]
+        outside = np.flatnonzero(np.abs(history - history[-1]) > convergence_tolerance)
+        settled.append(outside[-1] + 1 if len(outside) else 0)
+    return float(np.median(settled)) if settled else float("nan")
+
+def _init_worker(columns : Dict[str, np.ndarray], num_players : int) -> None:
+    global _columns, _num_players
+    _columns = columns
+    _num_players = num_players
+
+def _evaluate_worker(overrides : dict) -> dict:
+    return evaluate(_columns, _num_players, overrides)
+
+def sweep(match_json : dict, match_ids : List[str], grid : Dict[str, List], processes : int = sweep_processes) -> pd.DataFrame:
+    """
+    Replays the matches under every parameter set in grid across a process pool.
+
+    Parameters
+    ----------
+
+    match_json : dict
+            Parsed matches keyed by match_id.
+    match_ids : list
+            Matches to replay, oldest first.
+    grid : dict
+            Parameter name : list of values, see parameter_grid.
+    processes : int
+            Size of the process pool.
+
+    Returns
+    -------
+
+    results : DataFrame
+            One row per parameter set, best prediction accuracy first.
+    """
+
+    columns, players = match_columns(match_json, match_ids)
+    parameter_sets = parameter_grid(grid)
+    for overrides in parameter_sets:
+        EloParameters(**overrides) # Fail on unknown names before starting the pool
+
+    if processes <= 1:
+        results = [evaluate(columns, len(players), overrides) for overrides in parameter_sets]
+    else:
+        with ProcessPoolExecutor(max_workers = processes, initializer = _init_worker, initargs = (columns, len(players))) as executor:
+            results = list(executor.map(_evaluate_worker, parameter_sets))
+
+    return pd.DataFrame(results).sort_values(by = "prediction_accuracy", ascending = False).reset_index(drop = True)
+
+def sweep_func(dataset : dict, grid : Dict[str, List]) -> List[dict]:
+    "RQ job, sweeps the matches of a saved dataset and returns the results as records"
+    from dataset import load_match_list, load_matches
+
+    match_json = load_matches(dataset)
+    match_ids = [match_id for match_id in load_match_list(dataset)[::-1] if match_id in match_json]
+    return sweep(match_json, match_ids, grid).to_dict("records")
+
+# performance_average is left out since the team balancer in Elo.elo_changes divides it back out
+default_grid = {
+    "max_elo_difference" : [300, 400, 500],
+    "max_elo_reward" : [200, 245, 300],
+    "min_elo_reward" : [5, 20],
+    "dpr" : [0.4, 0.5329],
+    "impact" : [0.2372, 0.35]
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Sweep Elo parameters over a saved dataset")
+    parser.add_argument("dataset_id")
+    parser.add_argument("--version", type = int, default = None, help = "Defaults to the latest version")
+    parser.add_argument("--processes", type = int, default = sweep_processes)
+    args = parser.parse_args()
+
+    from dataset import latest_version, load_match_list, load_matches
+
+    handle = {"id" : args.dataset_id, "version" : args.version or latest_version(args.dataset_id)}
+    match_json = load_matches(handle)
+    match_ids = [match_id for match_id in load_match_list(handle)[::-1] if match_id in match_json]
+    print(sweep(match_json, match_ids, default_grid, args.processes).to_string())
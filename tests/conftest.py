@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Modules read their settings from the environment when imported and live at the top of the repo
+os.environ.setdefault("API_KEY", "test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,120 @@
+import copy
+from elo import _waves, match_columns, replay_elo
+from faceit import HubMatches, Match
+import pytest
+import random
+
+# replay_elo has to give exactly the Elo that Match.apply gives one match at a time, both for waves
+# replayed with Python floats and for waves vectorised with NumPy.
+
+def raw_match(rng : random.Random, team_one : list, team_two : list) -> dict:
+    "Returns match stats in the form the Faceit match stats endpoint does"
+    score_one = rng.randint(0, 16)
+    score_two = 16 if score_one < 15 else rng.randint(0, 14)
+    rounds = score_one + score_two
+
+    def player(player_id, won):
+        kills = rng.randint(3, 35)
+        deaths = rng.randint(5, 25)
+        return {
+            "player_id" : player_id,
+            "nickname" : f"name-{player_id}",
+            "player_stats" : {
+                "Kills" : str(kills),
+                "Deaths" : str(deaths),
+                "Assists" : str(rng.randint(0, 10)),
+                "K/R Ratio" : str(round(kills / rounds, 2)),
+                "K/D Ratio" : str(round(kills / deaths, 2)),
+                "MVPs" : str(rng.randint(0, 5)),
+                "Headshots" : str(rng.randint(0, kills)),
+                "Headshots %" : str(rng.randint(0, 100)),
+                "Triple Kills" : "0",
+                "Quadro Kills" : "0",
+                "Penta Kills" : "0",
+                "Result" : str(int(won))
+            }
+        }
+
+    return {
+        "game_mode" : "5v5",
+        "round_stats" : {"Rounds" : str(rounds), "Map" : rng.choice(["de_mirage", "de_inferno", "de_nuke"])},
+        "teams" : [
+            {"team_stats" : {"Final Score" : str(score_one)}, "players" : [player(p, score_one > score_two) for p in team_one]},
+            {"team_stats" : {"Final Score" : str(score_two)}, "players" : [player(p, score_two > score_one) for p in team_two]}
+        ]
+    }
+
+def history(seed : int, num_players : int, num_matches : int, team_sizes = (5,)) -> dict:
+    "Random match history keyed by match_id, oldest first"
+    rng = random.Random(seed)
+    pool = [f"player-{i}" for i in range(num_players)]
+    matches = {}
+    for i in range(num_matches):
+        sizes = (rng.choice(team_sizes), rng.choice(team_sizes))
+        players = rng.sample(pool, sum(sizes))
+        matches[f"match-{i}"] = raw_match(rng, players[:sizes[0]], players[sizes[0]:])
+    return matches
+
+def sequential(matches : dict) -> HubMatches:
+    "Parses matches one at a time with Match.apply"
+    hub = HubMatches("hub")
+    for match_id, data in matches.items():
+        hub.parse_match(match_id, copy.deepcopy(data))
+    return hub
+
+HISTORIES = {
+    # Few players, so nearly every wave holds a single match
+    "small pool" : (12, 300, (5,)),
+    # Many players, so the first waves hold far more than min_wave matches
+    "large pool" : (5000, 400, (5,)),
+    # Teams short of players after abandons are padded in the roster
+    "padded rosters" : (3000, 400, (3, 4, 5)),
+    "padded small pool" : (14, 300, (4, 5))
+}
+
+@pytest.mark.parametrize("min_wave", [1, 32, 10 ** 9])
+@pytest.mark.parametrize("name", HISTORIES)
+def test_replay_elo_matches_apply(name, min_wave):
+    hub = sequential(history(1, *HISTORIES[name]))
+    match_ids = list(hub.match_json)
+    columns, players = match_columns(hub.match_json, match_ids)
+    timeline = replay_elo(columns, len(players), min_wave = min_wave)
+
+    for i, match_id in enumerate(match_ids):
+        match = hub.match_json[match_id]
+        assert timeline["match_elo"][i] == match["match_elo"]
+        assert timeline["team_elo"][i, 0] == match["team_one_elo"]
+        assert timeline["team_elo"][i, 1] == match["team_two_elo"]
+        for team, team_players in enumerate((match["team_one"], match["team_two"])):
+            for slot, player in enumerate(team_players):
+                elo_data = match["player_elo_data"][player]
+                assert timeline["elo"][i, team, slot] == elo_data["Elo"]
+                assert timeline["elo_change"][i, team, slot] == elo_data["Elo Change"]
+                assert timeline["performance_target"][i, team, slot] == elo_data["Performance Target"]
+                assert timeline["performance_actual"][i, team, slot] == elo_data["Performance Actual"]
+            assert (columns["roster"][i, team, len(team_players):] == -1).all()
+
+    for i, player in enumerate(players):
+        assert timeline["final_elo"][i] == hub.player_json.elos[player]
+
+def test_large_pool_is_vectorised():
+    "The large histories have to reach the vectorised path for the comparisons above to cover it"
+    hub = sequential(history(1, *HISTORIES["padded rosters"]))
+    columns, _ = match_columns(hub.match_json, list(hub.match_json))
+    roster = [[[player for player in team if player >= 0] for team in teams] for teams in columns["roster"].tolist()]
+    waves = _waves(roster)
+    assert max(waves.count(wave) for wave in set(waves)) >= 32
+
+@pytest.mark.parametrize("name", HISTORIES)
+def test_recompute_elo_matches_parse_match(name):
+    matches = history(2, *HISTORIES[name])
+    expected = sequential(matches)
+
+    hub = HubMatches("hub")
+    for match_id, data in matches.items():
+        hub.apply_match(Match.parse(match_id, copy.deepcopy(data)), elo = False)
+    hub.recompute_elo(list(matches)[::-1])
+
+    assert hub.match_json == expected.match_json
+    assert hub.player_json.to_json() == expected.player_json.to_json()
+    assert hub.player_json.aggregates.average_performance() == expected.player_json.aggregates.average_performance()